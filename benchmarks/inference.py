@@ -0,0 +1,72 @@
+"""
+Single-hit classification cost of the TensorFlow ConvNet against the NumPy
+runtime it exports to, plus what importing TensorFlow costs the process:
+
+    python benchmarks/inference.py [--model convnet.npz] [-n 1000]
+
+The ConvNet is built from config.net_config with random weights (training
+does not change the cost) and exported to a temporary .npz. With --model an
+already exported model is used for the NumPy side and TensorFlow is only
+loaded to measure its import.
+"""
+import argparse
+import os
+import resource
+import tempfile
+import time
+import numpy as np
+import ml_midi.config as config
+from ml_midi.learning.runtime import NumpyConvNet
+from ml_midi.learning.bundle import label_names
+from ml_midi.processing.spectral import SpectrogramEngine
+
+
+def rss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+
+def measure(classify, x, n):
+    classify(x)
+    times = np.empty(n)
+    for i in range(n):
+        start = time.perf_counter()
+        classify(x)
+        times[i] = time.perf_counter() - start
+    return 1e6 * times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--model', default=None, help='exported .npz model')
+    parser.add_argument('-n', type=int, default=1000, help='classifications per path')
+    args = parser.parse_args()
+
+    engine = SpectrogramEngine()
+    engine.prepare(config.RECORDING_LENGTH)
+    wave = (np.random.RandomState(0).randn(config.RECORDING_LENGTH) * 3000).astype(np.int16)
+    x = engine.compute(wave, normalize=config.NORMALIZE)
+
+    start, memory = time.perf_counter(), rss()
+    from ml_midi.learning.conv import ConvNet
+    print('TensorFlow import: {:.2f} s, +{:.0f} MB max RSS'.format(
+        time.perf_counter() - start, rss() - memory))
+
+    results = []
+    path = args.model
+    if path is None:
+        net = ConvNet(input_shape=x.shape, labels=label_names())
+        path = net.export(os.path.join(tempfile.mkdtemp(), 'convnet.npz'))
+        results.append(('tensorflow', measure(net.classify, x, args.n)))
+    runtime = NumpyConvNet.load(path)
+    results.append(('numpy', measure(runtime.classify, x, args.n)))
+    if path != args.model:
+        print('max |tf - numpy|: {:.2e}'.format(np.abs(net.classify(x) - runtime.classify(x)).max()))
+
+    print('{} classifications of a {}x{} spectrogram'.format(args.n, *x.shape))
+    for name, times in results:
+        print('   {:10}: mean {:8.1f}  p50 {:8.1f}  p99 {:8.1f} us'.format(
+            name, times.mean(), np.percentile(times, 50), np.percentile(times, 99)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Per-message send overhead of the MIDI output paths:
+
+    message   build a mido.Message per send (the old note_off path)
+    prebuilt  send a mido.Message built at mapping load time
+    raw       RawOutput: pre-encoded bytes to the rtmidi handle
+
+    python benchmarks/midi_send.py [--port NAME] [-n 100000]
+
+Without --port the messages go to a null port that behaves like mido's
+rtmidi output (lock + msg.bytes() + send_message), so only the Python side
+is measured.
+"""
+import argparse
+import threading
+import time
+import mido
+from ml_midi.processing.midi import RawOutput
+
+
+class NullMidiOut(object):
+    def send_message(self, data):
+        pass
+
+
+class NullOutput(mido.ports.BaseOutput):
+    def __init__(self):
+        mido.ports.BaseOutput.__init__(self, 'null')
+        self._rt = NullMidiOut()
+        self._send_lock = threading.RLock()
+
+    def send(self, msg):
+        with self._send_lock:
+            self._rt.send_message(msg.bytes())
+
+
+def measure(send, messages, n):
+    k = len(messages)
+    start = time.perf_counter()
+    for i in range(n):
+        send(messages[i % k])
+    return (time.perf_counter() - start) / n
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--port', default=None, help='MIDI output port name')
+    parser.add_argument('-n', type=int, default=100000, help='messages per path')
+    args = parser.parse_args()
+
+    port = mido.open_output(args.port) if args.port else NullOutput()
+    notes = list(range(36, 52))
+    prebuilt = [mido.Message('note_off', note=note) for note in notes]
+    encoded = [tuple(message.bytes()) for message in prebuilt]
+    raw = RawOutput(port)
+
+    def message(note):
+        port.send(mido.Message('note_off', note=note))
+
+    results = [
+        ('message', measure(message, notes, args.n)),
+        ('prebuilt', measure(port.send, prebuilt, args.n)),
+        ('raw', measure(raw.send, encoded, args.n))]
+
+    print('{} x {} messages to {}{}'.format(
+        len(results), args.n, args.port or 'null port',
+        '' if raw.direct else ' (no rtmidi handle, raw falls back to mido)'))
+    for name, seconds in results:
+        print('   {:10}: {:8.3f} us/msg  {:6.1f}x'.format(
+            name, 1e6 * seconds, results[0][1] / seconds))
+
+
+if __name__ == '__main__':
+    main()
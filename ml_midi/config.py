@@ -2,6 +2,10 @@ import os, sys
 
 MAIN_DIR = os.path.dirname(os.path.realpath(__file__))
 DATA = os.path.join(MAIN_DIR, 'data')
+CONFIG_FILE = os.path.join(MAIN_DIR, 'config.yml')
+MODEL_DIR = os.path.join(DATA, 'models')
+MODEL_FILE = os.path.join(MODEL_DIR, 'convnet.npz')
+MODEL_BUNDLE = os.path.join(MODEL_DIR, 'convnet')
 
 SAMPLE_RATE = 44100
 RECORDING_LENGTH = 4096 # 16384 #8192 # 2048 # 4096
@@ -13,20 +17,82 @@ FFT_LENGTH = 2048
 THRESHOLD = 100
 NORMALIZE = False
 DETECTION_SAMPLE_SIZE = 128
+BATCH_SIZE = 16
+CACHE_DIR = os.path.join(DATA, 'cache')
+CACHE_BYTES = 256 * 2**20
+CACHE_DISK_BYTES = 2 * 2**30
+PACKED_DIR = os.path.join(DATA, 'packed')
+PACKED_DATASETS = False
+LOAD_WORKERS = 4
+COMPACT_RATIO = 0.25
+SYNC_INTERVAL = 1.0
+LATENCY_TARGET = 0.010
+STATS_WINDOW = 1000
+POLL_INTERVAL = 0.0005
+REFRESH_RATE = 60
+DISPLAY_POINTS = 512
+SPECTROGRAM_LEVELS = (40., 130.) # dB
+STREAM_HISTORY = 2048 # frames in the live waterfall
+STREAMING = False # classify a rolling window instead of triggered recordings
+GATE_LENGTH = 0.05
+RETRIGGER_TIME = 0.02
+VELOCITY_FROM_AMPLITUDE = True
+MIDI_RAW = True
+MIDI_BACKEND = 'mido' # mido, loopback
+PRE_TRIGGER = 256
+ONSET_METHOD = 'peak' # peak, rms, flux, hfc
+ONSET_RATIO = 4.0
+ONSET_WARMUP = 32 # detection frames that only set the noise floor (~93 ms)
+BUFFER_LENGTH = 4 * SAMPLE_RATE
 
 
 audio_config = dict(
     channels=1,
     device_index=1,
     chunk_size=128,
-    sample_rate=SAMPLE_RATE)
+    sample_rate=SAMPLE_RATE,
+    buffer_length=BUFFER_LENGTH)
 
 net_config = dict(
     filters=[16, 32, 64],
     kernel_size=[3, 3, 3],
     strides=[1, 1, 1],
     fc_layers=[128, 64, 32],
-    epochs=10)
+    pool_size=2,
+    epochs=30,
+    batch_size=64,
+    lr=0.001,
+    validation=0.2,
+    patience=3,
+    seed=0)
+
+mlp_config = dict(
+    hidden=[64],
+    band_pools=16,
+    time_pools=4,
+    epochs=200,
+    batch_size=32,
+    lr=0.003,
+    validation=0.2,
+    patience=15,
+    seed=0)
+
+knn_config = dict(
+    mode='knn', # knn, prototype
+    k=5,
+    band_pools=16,
+    time_pools=4,
+    ann_threshold=5000,
+    n_probe=4,
+    seed=0)
+
+streaming_config = dict(
+    frames=32, # rolling window the classifier sees, 32 hops ~ 29 ms
+    stride=4, # classify every `stride` hops
+    no_event=None, # class id of the no-event class, None: the config.yml label of type none
+    threshold=0.6, # posterior a hit has to reach
+    wait=2, # classifications a peak has to stay the highest
+    refractory=0.05) # s after a hit in which no other one is picked
 
 interface_config = dict(
     total_length = RECORDING_LENGTH,
@@ -52,14 +118,16 @@ mod_config = dict(
     FFT_LENGTH = FFT_LENGTH,
     THRESHOLD = THRESHOLD, 
     NORMALIZE = NORMALIZE,
-    DETECTION_SAMPLE_SIZE = DETECTION_SAMPLE_SIZE
+    DETECTION_SAMPLE_SIZE = DETECTION_SAMPLE_SIZE,
+    PRE_TRIGGER = PRE_TRIGGER
 )
 
 recording_config = dict(
     SAMPLE_RATE = SAMPLE_RATE,
     RECORDING_LENGTH = RECORDING_LENGTH, # 16384 #8192 # 2048 # 4096
     THRESHOLD = THRESHOLD, 
-    DETECTION_SAMPLE_SIZE = DETECTION_SAMPLE_SIZE
+    DETECTION_SAMPLE_SIZE = DETECTION_SAMPLE_SIZE,
+    PRE_TRIGGER = PRE_TRIGGER
 )
 
 spec_config = dict(
@@ -81,5 +149,6 @@ mappings = dict(
     SAMPLE_RATE = SAMPLE_RATE,
     RECORDING_LENGTH = RECORDING_LENGTH, # 16384 #8192 # 2048 # 4096
     THRESHOLD = THRESHOLD, 
-    DETECTION_SAMPLE_SIZE = DETECTION_SAMPLE_SIZE
+    DETECTION_SAMPLE_SIZE = DETECTION_SAMPLE_SIZE,
+    PRE_TRIGGER = PRE_TRIGGER
 )
\ No newline at end of file
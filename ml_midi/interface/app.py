@@ -1,8 +1,8 @@
 from PyQt5 import QtCore, QtWidgets, QtGui
 import sys, random, os, time
 import numpy as np
-from ml_midi.processing import AudioIO, Dataset, DataSample, Midi
-from ml_midi.learning import RetardedClassifier
+from ml_midi.processing import AudioIO, Dataset, DataSample, Midi, MidiController
+from ml_midi.learning import load_classifier, RetardedClassifier
 from .dataset import DatasetView
 from .record import RecordView
 from .imagedata import ModelView
@@ -82,7 +82,14 @@ class QtInterface(QtWidgets.QWidget):
         
         self.audio = AudioIO(**config.audio_config) 
         self.midi = Midi()
-        self.classifier = RetardedClassifier()
+        try:
+            self.classifier = load_classifier()
+        except ValueError as e:
+            # no silent fallback to random outputs, playing needs a model
+            self.classifier = None
+            QtWidgets.QMessageBox.warning(self, 'Model not loaded', str(e))
+        self.controller = MidiController(
+            classifier=self.classifier or RetardedClassifier(), audio=self.audio, midi=self.midi)
         
         self.record_view = RecordView(self)
         self.current_sample = None
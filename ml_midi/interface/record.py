@@ -1,69 +1,138 @@
 from PyQt5 import QtCore, QtWidgets, QtGui
 from QLed import QLed
 import pyqtgraph as pg
-import sys, random, os, time
-import numpy as np
-from ml_midi.processing import AudioIO
+import sys, random, os
+from collections import deque
+from .worker import DetectionWorker, HitRelay
+from .render import WaveformRenderer, SpectrogramRenderer
 import ml_midi.config as config
 
 class RecordView(QtWidgets.QWidget):
     def __init__(self, parent):
         super(RecordView, self).__init__(parent=parent)
         self.parent = parent
-        self.timer = QtCore.QTimer()
         self.running = False
-        self.recording = False
         self.current_max = 0
+        self.time_taken = 0.
+        self.buffer = None
+        self.thread = None
+        self.worker = None
+        self.hits = deque(maxlen=8)
+        self.relay = HitRelay()
+        self.relay.hit.connect(self.show_hit, QtCore.Qt.QueuedConnection)
+        # all drawing happens on these timers, at most at display rate
+        self.refresh_timer = QtCore.QTimer()
+        self.refresh_timer.timeout.connect(self.refresh)
+        self.report_timer = QtCore.QTimer()
+        self.report_timer.timeout.connect(self.update_report)
         self.setup()
-    
+
+    @property
+    def recording(self):
+        return self.worker is not None and self.worker.recording
+
     def loop(self):
+        """
+        Start detection and recording on a worker thread
+        """
+        if self.running:
+            return self.stop()
         self.running = True
+        self.buffer = self.parent.audio.start_capture()
+        self.thread = QtCore.QThread()
+        self.worker = DetectionWorker(self.buffer, self.parent.dataset)
+        self.worker.moveToThread(self.thread)
+        self.worker.recorded.connect(self.sample_recorded, QtCore.Qt.QueuedConnection)
+        self.worker.finished.connect(self.thread.quit)
+        self.thread.started.connect(self.worker.run)
+        self.thread.start()
+        self.refresh_timer.start(int(1000 / config.REFRESH_RATE))
         self.loop_button.setText('Stop')
-        self.loop_button.clicked.connect(self.stop)
-        self.timer.timeout.connect(self.detect)
-        self.timer.start(0.001)
         self.update_console()
 
     def stop(self):
-        self.timer.stop()
-        self.timer = QtCore.QTimer()
+        self.refresh_timer.stop()
+        if self.worker is not None:
+            self.worker.stop()
+            self.thread.quit()
+            self.thread.wait()
+            self.worker.finish()
+            self.worker, self.thread = None, None
+        if self.running:
+            self.parent.audio.stop_capture()
         self.running = False
-        self.loop_button.clicked.connect(self.loop)
+        self.record_led.value = False
+        self.loop_button.setText('Loop')
         self.update_console()
-    
-    def detect(self):
-        if self.recording:
-            self.record_sample()
-            self.record_led.value, self.recording = False, False
-        else:
-            data, _ = self.parent.audio.record(config.DETECTION_SAMPLE_SIZE)
-            self.update_sample(data)
-            self.current_max = max(data)
-            if self.current_max > config.THRESHOLD:
-                self.record_led.value, self.recording = True, True
-            self.update_console()
-        
-    def record_sample(self):
-        t0 = time.time()
-        data, raw = self.parent.audio.record(config.RECORDING_LENGTH)
-
-        sample = self.parent.dataset.new_sample(
-            wave=data, 
-            bytestring=raw, 
-            save=True)
 
-        self.update_spectrogram(sample.create_spectrogram())
+    def refresh(self):
+        """
+        Redraw the live state of the worker, called at REFRESH_RATE
+        """
+        self.record_led.value = self.recording
+        self.current_max = self.worker.level
+        self.waveform.push_buffer(self.buffer)
+        self.spectrogram.flush()
+        self.waterfall.push(self.worker.stream.image())
+        self.update_console()
 
-        y = 0
-        self.time_taken = time.time() - t0
-        self.update_console(y=y)
+    def sample_recorded(self, sample, time_taken):
+        """
+        Queued from the worker after every recording
+        """
+        self.time_taken = time_taken
+        self.update_spectrogram(sample.spectrogram)
+        self.update_console(y=0)
         self.parent.new_recording_made()
 
+    def play(self):
+        """
+        Toggle live classification: the headless controller classifies hits
+        and sends MIDI on its own thread, the view only observes its events
+        """
+        controller = self.parent.controller
+        if not controller.running:
+            if self.parent.classifier is None:
+                QtWidgets.QMessageBox.warning(self, 'No model', 'No model fits the current config.')
+                return
+            controller.classifier = self.parent.classifier
+            controller.subscribe(self.relay)
+            try:
+                controller.start()
+            except ValueError as e:
+                controller.unsubscribe(self.relay)
+                QtWidgets.QMessageBox.warning(self, 'Cannot play', str(e))
+                return
+            self.play_button.setText('Stop playing')
+            self.loop_button.setEnabled(False)
+            self.report_timer.start(500)
+        else:
+            self.report_timer.stop()
+            controller.stop()
+            controller.unsubscribe(self.relay)
+            self.play_button.setText('Play')
+            self.loop_button.setEnabled(self.parent.dataset is not None)
+
+    def show_hit(self, event):
+        """
+        Queued from the pipeline thread, drawn by the report timer
+        """
+        self.hits.append(event)
+
+    def update_report(self):
+        pipeline = self.parent.controller.pipeline
+        if pipeline is None:
+            return
+        message = pipeline.report()
+        if self.hits:
+            message += '\nLast hits: ' + ' '.join(str(event['label']) for event in self.hits)
+        self.console.setPlainText(message)
+
     def update_console(self, y=None):
-        if self.running:
-            status = 'Waiting for threshold...'
         if self.recording:
             status = 'Recording...'
+        elif self.running:
+            status = 'Waiting for threshold...'
         else:
             status = 'Stopped.'
         message = 'Status: {}\n'.format(status)
@@ -75,12 +144,10 @@ class RecordView(QtWidgets.QWidget):
         self.console.setPlainText(message)
     
     def update_spectrogram(self, image):
-        image = np.flip(image.T)[::-1]
-        self.spectrogram_display.setImage(image)
+        self.spectrogram.push(image)
 
     def update_sample(self, data):
-        data = np.abs(data)
-        self.sample_display.getPlotItem().plot(clear=True).setData(data)
+        self.waveform.push(data)
     
     def setup(self):
         self.layout = QtWidgets.QGridLayout()
@@ -99,16 +166,24 @@ class RecordView(QtWidgets.QWidget):
         self.loop_button.clicked.connect(self.loop)
         self.loop_button.setEnabled(False)
 
+        self.play_button = QtWidgets.QPushButton('Play')
+        self.play_button.setText('Play')
+        self.play_button.clicked.connect(self.play)
+
         self.device_info = QtWidgets.QPushButton('Devices')
         self.device_info.setText('Devices')
         self.device_info.clicked.connect(self.devices)
 
         self.sample_display = pg.PlotWidget()
         self.sample_display.getPlotItem().setTitle('Sample')
-        self.sample_display.setYRange(-20000, 20000)
+        self.sample_display.setYRange(-32768, 32767)
+        self.waveform = WaveformRenderer(self.sample_display)
 
         self.spectrogram_display = pg.ImageView()
-        # self.spectrogram_display.
+        self.spectrogram = SpectrogramRenderer(self.spectrogram_display)
+
+        self.waterfall_display = pg.ImageView()
+        self.waterfall = SpectrogramRenderer(self.waterfall_display, levels=config.SPECTROGRAM_LEVELS)
 
         self.console = QtWidgets.QPlainTextEdit()
         # self.console.setFixedSize(250, 200)
@@ -116,12 +191,15 @@ class RecordView(QtWidgets.QWidget):
         layout.addWidget(self.record_led, 1, 1, 1, 2)
         layout.addWidget(self.loop_button, 2, 1, 1, 2)
         layout.addWidget(self.device_info, 3, 1, 1, 2)
+        layout.addWidget(self.play_button, 4, 1, 1, 2)
         layout.setRowMinimumHeight(1, 50)
         layout.setRowMinimumHeight(2, 100)
         layout.addWidget(self.spectrogram_display, 6, 1, 1, 4)
         layout.setRowMinimumHeight(6, 300)
         layout.setColumnMinimumWidth(3, 600)
-        layout.addWidget(self.console, 7, 1, 1, 4)
+        layout.addWidget(self.waterfall_display, 7, 1, 1, 4)
+        layout.setRowMinimumHeight(7, 200)
+        layout.addWidget(self.console, 8, 1, 1, 4)
         layout.addWidget(self.sample_display, 1, 3, 5, 2)
         layout.setColumnMinimumWidth(3, 200)
 
@@ -0,0 +1,96 @@
+import time
+import numpy as np
+import ml_midi.config as config
+
+
+class Renderer(object):
+    """
+    Draws at most `fps` frames per second: push() keeps only the newest
+    data and draws it right away if a frame is due, otherwise on the
+    next flush() (called from the view's refresh timer)
+    """
+    def __init__(self, fps=None):
+        self.interval = 1. / (fps or config.REFRESH_RATE)
+        self.last = 0.
+        self.pending = None
+
+    def push(self, data):
+        self.pending = data
+        return self.flush()
+
+    def flush(self):
+        if self.pending is None:
+            return False
+        now = time.perf_counter()
+        if now - self.last < self.interval:
+            return False
+        data, self.pending = self.pending, None
+        self.draw(data)
+        self.last = now
+        return True
+
+    def draw(self, data):
+        raise NotImplementedError
+
+
+class WaveformRenderer(Renderer):
+    """
+    Min/max envelope of the last `span` samples in one persistent curve:
+    every one of the `points` columns is a vertical segment from the
+    minimum to the maximum of its samples, decimated into preallocated
+    arrays and drawn with setData(connect='pairs'), so only the two ends
+    of each column are joined
+    """
+    def __init__(self, plot_widget, span=None, points=None, fps=None):
+        super(WaveformRenderer, self).__init__(fps)
+        self.span = span or config.interface_config['total_length']
+        self.points = min(points or config.DISPLAY_POINTS, self.span)
+        self.block = self.span // self.points
+        self.x = np.repeat(np.arange(self.points) * self.block, 2).astype(np.float64)
+        self.y = np.zeros((self.points, 2), dtype=np.int16)
+        self.curve = plot_widget.getPlotItem().plot()
+        self.curve.setData(self.x, self.y.ravel(), connect='pairs')
+        plot_widget.setXRange(0, self.span, padding=0)
+
+    def push_buffer(self, buffer):
+        """
+        Scrolling view of the newest samples of a RingBuffer
+        """
+        if time.perf_counter() - self.last >= self.interval:
+            self.push(buffer.latest(self.span))
+
+    def draw(self, data):
+        n = min(len(data), self.span) // self.block
+        if n == 0:
+            return
+        columns = data[len(data) - n * self.block:].reshape(n, self.block)
+        y = self.y[self.points - n:]
+        np.min(columns, axis=1, out=y[:, 0])
+        np.max(columns, axis=1, out=y[:, 1])
+        self.y[:self.points - n] = 0
+        self.curve.setData(self.x, self.y.ravel(), connect='pairs')
+
+
+class SpectrogramRenderer(Renderer):
+    """
+    Pushes spectrograms into the image item of a pyqtgraph ImageView with
+    fixed levels (no autoscaling) and without copying: the (bands, frames)
+    array is shown through a transposed, flipped view
+    """
+    def __init__(self, image_view, levels=None, fps=None):
+        super(SpectrogramRenderer, self).__init__(fps)
+        self.view = image_view
+        self.item = image_view.getImageItem()
+        if levels is None:
+            levels = (0., 1.) if config.NORMALIZE else config.SPECTROGRAM_LEVELS
+        self.levels = levels
+        self.shape = None
+
+    def draw(self, image):
+        image = image.T[:, ::-1]
+        if image.shape != self.shape:
+            # first image or new size: let the view set up its range once
+            self.view.setImage(image, autoLevels=False, levels=self.levels)
+            self.shape = image.shape
+        else:
+            self.item.setImage(image, autoLevels=False, levels=self.levels)
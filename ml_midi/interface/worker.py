@@ -0,0 +1,121 @@
+from PyQt5 import QtCore
+import numpy as np
+import queue
+import threading
+import time
+import ml_midi.config as config
+from ml_midi.processing import create_detector, StreamingSpectrogram
+
+
+class DetectionWorker(QtCore.QObject):
+    """
+    Onset detection and recording on a QThread. It polls the capture ring
+    buffer and queues a copy of the window after every onset; a consumer
+    thread adds the queued waves to the dataset (running its observers)
+    and computes their spectrograms, so neither delays the next onset.
+    The view gets the recordings through a queued signal and reads the
+    continuous state (`level`, `recording`, the `stream` waterfall) on its
+    own redraw timer, so drawing never delays detection.
+    """
+    recorded = QtCore.pyqtSignal(object, float)
+    finished = QtCore.pyqtSignal()
+
+    def __init__(self, buffer, dataset):
+        super(DetectionWorker, self).__init__()
+        self.buffer = buffer
+        self.dataset = dataset
+        self.detector = create_detector()
+        self.stream = StreamingSpectrogram(buffer)
+        self.position = buffer.written
+        self.trigger = None
+        self.level = 0
+        self.running = False
+        self.waves = queue.Queue()
+        self.consumer = None
+
+    @property
+    def recording(self):
+        return self.trigger is not None
+
+    @QtCore.pyqtSlot()
+    def run(self):
+        self.running = True
+        self.consumer = threading.Thread(target=self.consume, daemon=True)
+        self.consumer.start()
+        while self.running:
+            if not self.step():
+                time.sleep(config.POLL_INTERVAL)
+        self.finished.emit()
+
+    def stop(self):
+        """
+        Ask the detection loop to stop, it exits after the current step
+        """
+        self.running = False
+
+    def finish(self):
+        """
+        Store the recordings queued so far and end the consumer, call once
+        the detection loop has exited so nothing is queued after the sentinel
+        """
+        if self.consumer is not None:
+            self.waves.put(None)
+            self.consumer.join()
+            self.consumer = None
+
+    def step(self):
+        """
+        Process what arrived in the buffer, returns False when idle
+        """
+        self.stream.update()
+        if self.trigger is not None:
+            if self.buffer.written < self.trigger + config.RECORDING_LENGTH:
+                return False
+            self.record()
+            return True
+
+        self.position = max(self.position, self.buffer.oldest())
+        n = self.buffer.available(self.position)
+        if n < config.DETECTION_SAMPLE_SIZE:
+            return False
+        onset = self.detector.process(self.buffer.view(self.position, n), self.position)
+        self.level = int(self.detector.level)
+        self.position += n
+        if onset is not None:
+            self.trigger = max(self.buffer.oldest(), onset - config.PRE_TRIGGER)
+        return True
+
+    def record(self):
+        """
+        Queue a copy of the recorded window, the ring buffer moves on
+        """
+        data = self.buffer.view(self.trigger, config.RECORDING_LENGTH)
+        self.position = self.trigger + config.RECORDING_LENGTH
+        self.trigger = None
+        if data is None:
+            return
+        self.waves.put((np.array(data), self.dataset.current_label, time.time()))
+
+    def consume(self):
+        """
+        Store the queued recordings (consumer thread)
+        """
+        while True:
+            item = self.waves.get()
+            if item is None:
+                break
+            wave, label, t0 = item
+            sample = self.dataset.new_sample(wave=wave, label=label, save=True)
+            sample.create_spectrogram()
+            self.recorded.emit(sample, time.time() - t0)
+
+
+class HitRelay(QtCore.QObject):
+    """
+    Forwards the controller's hit events (pipeline thread) to the GUI
+    thread as a queued signal
+    """
+    hit = QtCore.pyqtSignal(object)
+
+    def __call__(self, event):
+        self.hit.emit(event)
@@ -1,2 +1,12 @@
-from .conv import ConvNet
-from .naive import RetardedClassifier
\ No newline at end of file
+from .naive import RetardedClassifier
+from .mlp import MLP, spectral_features
+from .prototype import PrototypeClassifier
+from .runtime import NumpyConvNet, load_classifier
+
+
+def __getattr__(name):
+    # TensorFlow is only imported when the trainable ConvNet is asked for
+    if name == 'ConvNet':
+        from .conv import ConvNet
+        return ConvNet
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
@@ -0,0 +1,105 @@
+import hashlib
+import json
+import os
+import numpy as np
+import ml_midi.config as config
+
+FORMAT = 1
+parameter_names = (
+    'SAMPLE_RATE', 'RECORDING_LENGTH', 'FFT_LENGTH', 'TIMESTEPS',
+    'FREQUENCY_BANDS', 'SPECTROGRAM_LOW', 'SPECTROGRAM_HIGH', 'NORMALIZE')
+
+
+def spectrogram_parameters():
+    """
+    The current recording/spectrogram settings a model depends on
+    """
+    return {name: getattr(config, name) for name in parameter_names}
+
+
+def fingerprint(parameters):
+    text = json.dumps(parameters, sort_keys=True)
+    return hashlib.blake2b(text.encode(), digest_size=8).hexdigest()
+
+
+def save_bundle(directory, weights, meta):
+    """
+    Model bundle: weights/<name>.npy (one file per array, in the order of
+    `weights`) and model.json with `meta`, the spectrogram parameters and
+    their fingerprint. Weight files of a previous model saved to the same
+    directory are deleted.
+    """
+    weight_dir = os.path.join(directory, 'weights')
+    if not os.path.isdir(weight_dir):
+        os.makedirs(weight_dir)
+    for name, value in weights:
+        np.save(os.path.join(weight_dir, name + '.npy'), np.ascontiguousarray(value))
+
+    parameters = spectrogram_parameters()
+    meta = dict(meta,
+        format=FORMAT,
+        weights=[name for name, _ in weights],
+        parameters=parameters,
+        fingerprint=fingerprint(parameters))
+    path = os.path.join(directory, 'model.json')
+    with open(path + '.tmp', 'w') as f:
+        json.dump(meta, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+    names = set(name + '.npy' for name, _ in weights)
+    for name in os.listdir(weight_dir):
+        if name.endswith('.npy') and name not in names:
+            os.remove(os.path.join(weight_dir, name))
+
+    return directory
+
+
+def load_bundle(directory, mmap=True, validate=True):
+    """
+    (list of (name, weights), meta) of a bundle. The weights are memory
+    mapped read-only unless mmap=False. With validate, raises ValueError
+    if the bundle was made with other spectrogram parameters or labels
+    than the current config
+    """
+    with open(os.path.join(directory, 'model.json')) as f:
+        meta = json.load(f)
+    if meta.get('format') != FORMAT:
+        raise ValueError('{}: unsupported model format {}'.format(directory, meta.get('format')))
+    if validate:
+        check_parameters(meta, directory)
+        check_labels(meta, directory)
+
+    mode = 'r' if mmap else None
+    weights = [(name, np.load(os.path.join(directory, 'weights', name + '.npy'), mmap_mode=mode))
+               for name in meta['weights']]
+    return weights, meta
+
+
+def check_parameters(meta, source=''):
+    current = spectrogram_parameters()
+    if fingerprint(current) == meta['fingerprint']:
+        return
+    changed = ['{}: {} (model) != {} (config)'.format(name, meta['parameters'].get(name), value)
+               for name, value in current.items() if meta['parameters'].get(name) != value]
+    raise ValueError('{} was trained with other spectrogram parameters:\n   {}'.format(
+        source or 'Model', '\n   '.join(changed)))
+
+
+def label_names():
+    """
+    Class names of the config.yml labels, in class id order
+    """
+    from ml_midi.processing.outputs import class_names
+    return class_names()
+
+
+def check_labels(meta, source=''):
+    """
+    The model's classes are the class ids of the config.yml labels,
+    raises ValueError if their names or their order differ
+    """
+    current = label_names()
+    if list(meta['labels']) == current:
+        return
+    raise ValueError('{} was trained on other labels:\n   {} (model) != {} (config)'.format(
+        source or 'Model', meta['labels'], current))
@@ -1,108 +1,264 @@
-# import tensorflow as tf
+import tensorflow.compat.v1 as tf
 import numpy as np
-import config
-from random import shuffle
-# from data_handler import DataIO, Dataset
-from ml_midi.processing import DataIO, Dataset
+import json, os, time
+import ml_midi.config as config
+from .bundle import save_bundle, load_bundle, spectrogram_parameters, fingerprint, label_names
+
 
 class ConvNet(object):
     """
-    Save net parameters in YAML files
+    Convolutional classifier of (bands, frames) spectrograms.
+
+    The layers come from net_config: conv layers (`filters`, `kernel_size`,
+    `strides`, valid padding, ReLU), each followed by `pool_size` max
+    pooling, then the `fc_layers` and a softmax output. Training runs on a
+    precomputed feature tensor in shuffled mini-batches (fixed `seed`), holds
+    out a `validation` fraction and stops once the validation loss has not
+    improved for `patience` epochs, keeping the best weights.
     """
-    def __init__(self, config):
-        self.dataset = Dataset('default')
-        self.bins = 20
-        self.n_labels = 1
-        self.lr = 0.001
-        self.config = config
-        self.session = tf.Session()
-        self.graph = tf.Graph()
-        self.setup()
+    def __init__(self, net_config=None, input_shape=None, labels=None):
+        self.config = dict(config.net_config, **(net_config or {}))
+        self.lr = self.config['lr']
+        self.labels = list(labels) if labels is not None else None
+        self.input_shape = tuple(input_shape) if input_shape is not None else None
+        self.mean, self.std = 0., 1.
+        self.history = []
+        self.graph = None
+        self.session = None
+        if self.input_shape is not None and self.labels is not None:
+            self.setup()
+
+    @property
+    def n_labels(self):
+        return len(self.labels)
 
     def setup(self):
+        self.n_outputs = self.n_labels
+        self.graph = tf.Graph()
         with self.graph.as_default():
+            tf.set_random_seed(self.config['seed'])
             self._placeholders()
             self._build_net()
-            self.loss = tf.reduce_mean(tf.square(self.output - self.labels))
+            self.loss = tf.reduce_mean(
+                tf.nn.sparse_softmax_cross_entropy_with_logits(
+                    labels=self.labels_ph, logits=self.logits))
+            self.correct = tf.reduce_sum(tf.cast(
+                tf.equal(tf.argmax(self.logits, axis=1, output_type=tf.int32), self.labels_ph),
+                tf.float32))
             self.train_op = tf.train.AdamOptimizer(self.lr).minimize(self.loss)
+            self.variables = tf.trainable_variables()
+            self.assign_phs = [tf.placeholder(v.dtype.base_dtype, v.shape) for v in self.variables]
+            self.assign_op = tf.group(*[v.assign(ph) for v, ph in zip(self.variables, self.assign_phs)])
             self.init = tf.global_variables_initializer()
+        self.session = tf.Session(graph=self.graph)
+        self.session.run(self.init)
 
     def _placeholders(self):
-        self.input_ph = tf.placeholder(tf.float32, shape=(None, self.dataset.h, self.dataset.w, 1,), name='input')
-        
+        self.input_ph = tf.placeholder(tf.float32, shape=(None,) + self.input_shape + (1,), name='input')
+        self.labels_ph = tf.placeholder(tf.int32, shape=(None,), name='labels')
+
     def _build_net(self):
         """
         Build the network based on the network config parameters
         """
-        output = tf.layers.conv2d(
-            inputs=self.input_ph,
-            filters=self.config.filters[0],
-            strides=self.config.strides[0],
-            kernel_size=self.config.kernel[0],
-            activation=tf.nn.relu,
-            name='c0')
-
-        for i, layer in enumerate(self.config.filters[1:]):
-            output = tf.layers.conv2d(
-                inputs=output,
-                filters=layer,
-                strides=self.config.strides[i+1],
-                kernel_size=self.config.kernel_size[i+1],
-                activation=tf.nn.relu,
-                name='c{}'.format(i+1))
+        output = self.input_ph
+        pool = self.config['pool_size']
+        for i, layer in enumerate(self.config['filters']):
+            output = self._conv(output, layer, self.config['kernel_size'][i],
+                                self.config['strides'][i], 'c{}'.format(i))
+            if pool > 1:
+                output = tf.nn.max_pool2d(output, pool, pool, 'VALID', name='p{}'.format(i))
 
         # Fully connected layers
-        output = tf.layers.flatten(output)
-        for i, layer in enumerate(self.config.fc_layers):
-            output = tf.layers.dense(
-                output,
-                layer,
-                activation=tf.nn.relu,
-                name='fc{}'.format(i))
-
-        self.output = tf.layers.dense(
-            output,
-            self.dataset.n_labels,
-            activation=tf.nn.softmax,
-            name='output')
-
-    def train(self):
-        """
-        Train the net
-        """
-        for epoch in self.config.epochs:
-            data, labels = self.dataset.get_batch()
-            labels = tf.one_hot(labels, self.dataset.n_labels)
-            feed_dict = {self.input_ph: data,
-                         self.labels: labels}
-            loss, _ = self.session.run([self.loss, self.train_op], feed_dict=feed_dict)
-            print('Epoch: {}/{}, loss: {}...'.format(epoch+1, self.config.epochs, loss))
+        size = int(np.prod(output.shape[1:]))
+        output = tf.reshape(output, [-1, size])
+        for i, layer in enumerate(self.config['fc_layers']):
+            output = tf.nn.relu(self._dense(output, layer, 'fc{}'.format(i)))
+
+        self.logits = self._dense(output, self.n_labels, 'output')
+        self.output = tf.nn.softmax(self.logits)
+
+    # the layers are built from tf.nn ops (tf.layers is gone with Keras 3),
+    # the variables are named <layer>/kernel and <layer>/bias as the runtime expects
+
+    def _conv(self, x, filters, kernel_size, stride, name):
+        with tf.variable_scope(name):
+            kernel = tf.get_variable(
+                'kernel', (kernel_size, kernel_size, int(x.shape[-1]), filters),
+                initializer=tf.glorot_uniform_initializer())
+            bias = tf.get_variable('bias', (filters,), initializer=tf.zeros_initializer())
+            return tf.nn.relu(tf.nn.conv2d(x, kernel, stride, 'VALID') + bias)
+
+    def _dense(self, x, units, name):
+        with tf.variable_scope(name):
+            kernel = tf.get_variable(
+                'kernel', (int(x.shape[-1]), units),
+                initializer=tf.glorot_uniform_initializer())
+            bias = tf.get_variable('bias', (units,), initializer=tf.zeros_initializer())
+            return tf.matmul(x, kernel) + bias
+
+    def features(self, x):
+        """
+        Standardized network input (n, bands, frames, 1) of a spectrogram
+        or a batch of them
+        """
+        x = np.asarray(x, dtype=np.float32)
+        if x.ndim == 2:
+            x = x[None]
+        return ((x - self.mean) / self.std)[..., None]
+
+    def train(self, x=None, y=None, dataset=None, epochs=None):
+        """
+        Train the net on spectrograms x (n, bands, frames) with integer labels
+        y, or on all the samples of a Dataset (with the config.yml class
+        ids, so the net has one output per config.yml label). Returns the
+        per epoch history
+        """
+        if x is None:
+            self.labels = label_names()
+            x, y = dataset.training_data(labels=self.labels)
+        y = np.asarray(y, dtype=np.int32)
+        if self.labels is None:
+            self.labels = [str(i) for i in range(int(y.max()) + 1)]
+        epochs = epochs or self.config['epochs']
+        batch_size = self.config['batch_size']
+
+        rng = np.random.RandomState(self.config['seed'])
+        order = rng.permutation(len(x))
+        n_val = int(round(self.config['validation'] * len(x)))
+        val, train = order[:n_val], order[n_val:]
+
+        # the whole feature tensor is standardized once, batches are slices of it
+        self.mean = float(np.mean(x[train]))
+        self.std = float(np.std(x[train])) or 1.
+        x = self.features(x)
+        if self.session is None or self.input_shape != x.shape[1:3] \
+                or self.n_outputs != self.n_labels:
+            self.input_shape = x.shape[1:3]
+            self.setup()
+        self.validation = (x[val], y[val])
+
+        best, best_weights, waiting = np.inf, None, 0
+        self.history = []
+        for epoch in range(epochs):
+            start = time.perf_counter()
+            rng.shuffle(train)
+            total = 0.
+            for i in range(0, len(train), batch_size):
+                batch = train[i:i+batch_size]
+                feed_dict = {self.input_ph: x[batch], self.labels_ph: y[batch]}
+                loss, _ = self.session.run([self.loss, self.train_op], feed_dict=feed_dict)
+                total += loss * len(batch)
+            elapsed = time.perf_counter() - start
+
+            val_loss, val_accuracy = self.evaluate(*self.validation) if n_val else (total / len(train), np.nan)
+            self.history.append(dict(
+                epoch=epoch + 1,
+                loss=total / len(train),
+                val_loss=val_loss,
+                val_accuracy=val_accuracy,
+                samples_per_sec=len(train) / elapsed))
+            print('Epoch: {}/{}, loss: {:.4f}, val loss: {:.4f}, val acc: {:.3f}, {:.0f} samples/s'.format(
+                epoch + 1, epochs, total / len(train), val_loss, val_accuracy, len(train) / elapsed))
+
+            if val_loss < best:
+                best, best_weights, waiting = val_loss, self.get_weights(), 0
+            else:
+                waiting += 1
+                if waiting >= self.config['patience']:
+                    print('Early stopping, best val loss: {:.4f}'.format(best))
+                    break
+
+        if best_weights is not None:
+            self.set_weights(best_weights)
+        return self.history
+
+    def evaluate(self, x, y):
+        """
+        Mean loss and accuracy over prepared features x (see features())
+        """
+        loss, correct = 0., 0.
+        batch_size = self.config['batch_size']
+        for i in range(0, len(x), batch_size):
+            feed_dict = {self.input_ph: x[i:i+batch_size], self.labels_ph: y[i:i+batch_size]}
+            l, c = self.session.run([self.loss, self.correct], feed_dict=feed_dict)
+            loss += l * len(x[i:i+batch_size])
+            correct += c
+        return loss / len(x), correct / len(x)
 
     def validate(self):
         """
-        Validate the current model on the test set
+        Validate the current model on the held out set
         """
-        data, labels = self.dataset.test_set, self.dataset.test_labels
-        output = self.classify(data)
-        output_labels = np.argmax(output, axis=1)
-        misclassified = output == output_labels
-        n_misclassified = np.sum(misclassified)
-        print('Test set: misclassified {}/{}'.format(n_misclassified, len(labels)))
+        data, labels = self.validation
+        output = self.session.run(self.output, feed_dict={self.input_ph: data})
+        n_misclassified = np.sum(np.argmax(output, axis=1) != labels)
+        print('Validation set: misclassified {}/{}'.format(n_misclassified, len(labels)))
+        return n_misclassified
+
+    def get_weights(self):
+        return self.session.run(self.variables)
+
+    def set_weights(self, weights):
+        self.session.run(self.assign_op, feed_dict=dict(zip(self.assign_phs, weights)))
 
     def classify(self, x):
         """
-        Forward pass through the net
+        Forward pass through the net, x is a (bands, frames) spectrogram or
+        a batch of them, returns the class probabilities
         """
-        feed_dict = {self.input_ph: x}
+        feed_dict = {self.input_ph: self.features(x)}
         out = self.session.run(self.output, feed_dict=feed_dict)
         return np.squeeze(out)
 
-    def save(self):
-        pass
+    def metadata(self):
+        """
+        What the forward pass needs besides the weights
+        """
+        return dict(
+            labels=[str(label) for label in self.labels],
+            input_shape=list(self.input_shape),
+            mean=self.mean,
+            std=self.std,
+            strides=list(self.config['strides'][:len(self.config['filters'])]),
+            pool_size=self.config['pool_size'],
+            fc_layers=list(self.config['fc_layers']),
+            net_config=self.config)
 
-    def load(self):
-        pass
+    def named_weights(self):
+        return [(variable.name.split(':')[0].replace('/', '.'), value)
+                for variable, value in zip(self.variables, self.get_weights())]
 
-    
+    def export(self, path=None):
+        """
+        Write the weights and what the forward pass needs to a flat .npz
+        for learning.runtime.NumpyConvNet (default config.MODEL_FILE)
+        """
+        path = path or config.MODEL_FILE
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        parameters = spectrogram_parameters()
+        meta = dict(self.metadata(), parameters=parameters, fingerprint=fingerprint(parameters))
+        np.savez(path, meta=np.array(json.dumps(meta)), **dict(self.named_weights()))
+        return path
 
+    def save(self, path=None):
+        """
+        Save a model bundle (see learning.bundle) to the directory
+        path, default config.MODEL_BUNDLE
+        """
+        return save_bundle(path or config.MODEL_BUNDLE, self.named_weights(), self.metadata())
 
+    @classmethod
+    def load(cls, path=None, validate=True):
+        """
+        Rebuild a saved net, raises ValueError if the spectrogram settings
+        or the labels of the current config differ from the ones it was
+        trained with
+        """
+        weights, meta = load_bundle(path or config.MODEL_BUNDLE, validate=validate)
+        net = cls(meta['net_config'], meta['input_shape'], meta['labels'])
+        net.mean, net.std = meta['mean'], meta['std']
+        net.set_weights([value for _, value in weights])
+        return net
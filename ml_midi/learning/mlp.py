@@ -0,0 +1,226 @@
+import numpy as np
+import json, time
+import ml_midi.config as config
+
+
+pool_matrices = {}
+
+
+def pool_matrix(n, pools):
+    """
+    (n, pools) matrix averaging (nearly) equal consecutive segments, cached
+    """
+    key = (n, pools)
+    if key not in pool_matrices:
+        edges = np.linspace(0, n, min(pools, n) + 1).astype(int)
+        matrix = np.zeros((n, len(edges) - 1), dtype=np.float32)
+        for i, (a, b) in enumerate(zip(edges[:-1], edges[1:])):
+            matrix[a:b, i] = 1. / (b - a)
+        pool_matrices[key] = matrix
+    return pool_matrices[key]
+
+
+def spectral_features(spectrogram, band_pools=16, time_pools=4):
+    """
+    Compact feature vector of a (bands, frames) spectrogram, or a matrix of
+    them for a batch:
+
+        band_pools x time_pools grid of mean mel energies
+        spectral centroid (in bands, 0..1) per time pool
+        onset envelope (rise of the mean band energy) per time pool
+
+    Everything is derived from a few matrix products with small cached
+    averaging matrices and the per frame band sums, so a single spectrogram
+    takes tens of microseconds.
+    """
+    s = np.asarray(spectrogram, dtype=np.float32)
+    single = s.ndim == 2
+    if single:
+        s = s[None]
+    n, bands, frames = s.shape
+    bp = pool_matrix(bands, band_pools)
+    tp = pool_matrix(frames, time_pools)
+    index = np.arange(bands, dtype=np.float32) / bands
+
+    grid = (bp.T @ s @ tp).reshape(n, -1)
+
+    # centroid with the weights shifted to be non negative (s - min)
+    low = s.min(axis=(1, 2))[:, None]
+    total = s.sum(axis=1)
+    centroid = (index @ s - low * index.sum()) / (total - low * bands + 1e-6)
+
+    envelope = np.diff(total, axis=1) / bands
+    np.maximum(envelope, 0, out=envelope)
+
+    features = np.concatenate([
+        grid,
+        centroid @ tp,
+        envelope @ pool_matrix(frames - 1, time_pools)], axis=1)
+
+    return features[0] if single else features
+
+
+class MLP(object):
+    """
+    Small fully connected classifier on spectral_features(), trained and
+    run in pure NumPy: ReLU hidden layers, softmax output, cross-entropy
+    loss and Adam. Training follows ConvNet: seeded shuffled mini-batches,
+    a validation split and early stopping on the validation loss.
+    Same classify() interface as ConvNet, at a fraction of the cost.
+    """
+    def __init__(self, mlp_config=None, labels=None):
+        self.config = dict(config.mlp_config, **(mlp_config or {}))
+        self.labels = list(labels) if labels is not None else None
+        self.weights = []
+        self.mean, self.std = 0., 1.
+        self.history = []
+
+    @property
+    def n_labels(self):
+        return len(self.labels)
+
+    def features(self, x):
+        return spectral_features(x, self.config['band_pools'], self.config['time_pools'])
+
+    def setup(self, n_inputs):
+        rng = np.random.RandomState(self.config['seed'])
+        sizes = [n_inputs] + list(self.config['hidden']) + [self.n_labels]
+        self.weights = []
+        for n_in, n_out in zip(sizes[:-1], sizes[1:]):
+            self.weights.append(
+                (rng.randn(n_in, n_out) * np.sqrt(2. / n_in)).astype(np.float32))
+            self.weights.append(np.zeros(n_out, dtype=np.float32))
+
+    def forward(self, x, activations=None):
+        """
+        Logits of standardized features x (n, d), keeps the layer
+        inputs in `activations` for backprop
+        """
+        n_layers = len(self.weights) // 2
+        for i in range(n_layers):
+            if activations is not None:
+                activations.append(x)
+            x = x @ self.weights[2*i] + self.weights[2*i+1]
+            if i < n_layers - 1:
+                x = np.maximum(x, 0)
+        return x
+
+    def loss(self, logits, y):
+        logits = logits - logits.max(axis=1, keepdims=True)
+        log_p = logits - np.log(np.exp(logits).sum(axis=1, keepdims=True))
+        return -log_p[np.arange(len(y)), y].mean(), np.exp(log_p)
+
+    def gradients(self, x, y):
+        activations = []
+        loss, p = self.loss(self.forward(x, activations), y)
+        delta = p
+        delta[np.arange(len(y)), y] -= 1
+        delta /= len(y)
+        grads = [None] * len(self.weights)
+        for i in reversed(range(len(activations))):
+            grads[2*i] = activations[i].T @ delta
+            grads[2*i+1] = delta.sum(axis=0)
+            if i > 0:
+                delta = (delta @ self.weights[2*i].T) * (activations[i] > 0)
+        return loss, grads
+
+    def train(self, x=None, y=None, dataset=None, epochs=None):
+        """
+        Train on spectrograms x (n, bands, frames) with integer labels y, or
+        on all the samples of a Dataset (with the config.yml class ids).
+        Returns the per epoch history
+        """
+        if x is None:
+            from .bundle import label_names
+            self.labels = label_names()
+            x, y = dataset.training_data(labels=self.labels)
+        y = np.asarray(y, dtype=np.int64)
+        if self.labels is None:
+            self.labels = [str(i) for i in range(int(y.max()) + 1)]
+        epochs = epochs or self.config['epochs']
+        batch_size = self.config['batch_size']
+        lr, beta1, beta2, eps = self.config['lr'], 0.9, 0.999, 1e-8
+
+        rng = np.random.RandomState(self.config['seed'])
+        order = rng.permutation(len(x))
+        n_val = int(round(self.config['validation'] * len(x)))
+        val, train = order[:n_val], order[n_val:]
+
+        features = self.features(x)
+        self.mean = features[train].mean(axis=0)
+        self.std = features[train].std(axis=0) + 1e-6
+        features = (features - self.mean) / self.std
+        self.setup(features.shape[1])
+        m = [np.zeros_like(w) for w in self.weights]
+        v = [np.zeros_like(w) for w in self.weights]
+
+        best, best_weights, waiting, step = np.inf, None, 0, 0
+        self.history = []
+        for epoch in range(epochs):
+            start = time.perf_counter()
+            rng.shuffle(train)
+            total = 0.
+            for i in range(0, len(train), batch_size):
+                batch = train[i:i+batch_size]
+                loss, grads = self.gradients(features[batch], y[batch])
+                total += loss * len(batch)
+                step += 1
+                for w, g, m_, v_ in zip(self.weights, grads, m, v):
+                    m_ *= beta1
+                    m_ += (1 - beta1) * g
+                    v_ *= beta2
+                    v_ += (1 - beta2) * g * g
+                    w -= lr * (m_ / (1 - beta1 ** step)) / (np.sqrt(v_ / (1 - beta2 ** step)) + eps)
+            elapsed = time.perf_counter() - start
+
+            if n_val:
+                val_loss, p = self.loss(self.forward(features[val]), y[val])
+                val_accuracy = float(np.mean(np.argmax(p, axis=1) == y[val]))
+            else:
+                val_loss, val_accuracy = total / len(train), np.nan
+            self.history.append(dict(
+                epoch=epoch + 1,
+                loss=total / len(train),
+                val_loss=val_loss,
+                val_accuracy=val_accuracy,
+                samples_per_sec=len(train) / elapsed))
+
+            if val_loss < best:
+                best, best_weights, waiting = val_loss, [w.copy() for w in self.weights], 0
+            else:
+                waiting += 1
+                if waiting >= self.config['patience']:
+                    break
+
+        if best_weights is not None:
+            self.weights = best_weights
+        last = self.history[-1]
+        print('Epochs: {}, loss: {:.4f}, best val loss: {:.4f}, val acc: {:.3f}, {:.0f} samples/s'.format(
+            last['epoch'], last['loss'], best, last['val_accuracy'], last['samples_per_sec']))
+        return self.history
+
+    def classify(self, x):
+        """
+        Class probabilities of a (bands, frames) spectrogram or a batch of them
+        """
+        features = (self.features(x) - self.mean) / self.std
+        logits = self.forward(np.atleast_2d(features))
+        logits -= logits.max(axis=1, keepdims=True)
+        p = np.exp(logits)
+        p /= p.sum(axis=1, keepdims=True)
+        return np.squeeze(p)
+
+    def save(self, path):
+        meta = dict(config=self.config, labels=[str(label) for label in self.labels])
+        arrays = {'w{}'.format(i): w for i, w in enumerate(self.weights)}
+        np.savez(path, meta=np.array(json.dumps(meta)), mean=self.mean, std=self.std, **arrays)
+        return path
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            meta = json.loads(str(data['meta']))
+            net = cls(meta['config'], meta['labels'])
+            net.mean, net.std = data['mean'], data['std']
+            net.weights = [data['w{}'.format(i)] for i in range(len(data.files) - 3)]
+        return net
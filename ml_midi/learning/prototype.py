@@ -0,0 +1,212 @@
+import threading
+import numpy as np
+import ml_midi.config as config
+from .mlp import spectral_features
+from .bundle import label_names
+
+
+class PrototypeClassifier(object):
+    """
+    Classifier without a training step: keeps the spectral_features() of
+    every enrolled sample and answers with the k nearest neighbours
+    (mode='knn') or the nearest per-label mean (mode='prototype').
+
+    add() is O(1) (amortized, the embedding matrix grows by doubling and the
+    per-label sums are updated in place), so a sample recorded on stage is
+    recognized by the next query. Distances are computed for all samples in
+    one vectorized pass, features are weighted by their running inverse
+    variance. Past `ann_threshold` samples the knn search goes through a
+    coarse k-means index (IVF) and only scans the `n_probe` closest lists.
+    """
+    def __init__(self, knn_config=None, labels=None):
+        self.config = dict(config.knn_config, **(knn_config or {}))
+        self.k = self.config['k']
+        self.mode = self.config['mode']
+        self.labels = list(labels) if labels is not None else []
+        self.count = 0
+        self.embeddings = None
+        self.codes = None
+        self.sums = None
+        self.counts = None
+        self.total = None
+        self.total_sq = None
+        self.ann = None
+        self.lock = threading.Lock()
+
+    @property
+    def n_labels(self):
+        return len(self.labels)
+
+    def features(self, x):
+        return spectral_features(x, self.config['band_pools'], self.config['time_pools'])
+
+    def _allocate(self, capacity, dimension):
+        embeddings = np.zeros((capacity, dimension), dtype=np.float32)
+        codes = np.zeros(capacity, dtype=np.int32)
+        if self.embeddings is not None:
+            embeddings[:self.count] = self.embeddings[:self.count]
+            codes[:self.count] = self.codes[:self.count]
+        self.embeddings, self.codes = embeddings, codes
+
+    def label_code(self, label):
+        if label not in self.labels:
+            self.labels.append(label)
+        code = self.labels.index(label)
+        if self.sums is None:
+            self.sums = np.zeros((0, self.embeddings.shape[1]), dtype=np.float64)
+            self.counts = np.zeros(0, dtype=np.int64)
+        if code >= len(self.counts):
+            grow = code + 1 - len(self.counts)
+            self.sums = np.vstack([self.sums, np.zeros((grow, self.sums.shape[1]))])
+            self.counts = np.concatenate([self.counts, np.zeros(grow, dtype=np.int64)])
+        return code
+
+    def add(self, spectrogram, label, features=None):
+        """
+        Enrol one sample (a spectrogram, or its features)
+        """
+        embedding = self.features(spectrogram) if features is None else features
+        with self.lock:
+            if self.embeddings is None:
+                self._allocate(64, len(embedding))
+                self.total = np.zeros(len(embedding))
+                self.total_sq = np.zeros(len(embedding))
+            elif self.count == len(self.embeddings):
+                self._allocate(2 * self.count, self.embeddings.shape[1])
+            code = self.label_code(label)
+            self.embeddings[self.count] = embedding
+            self.codes[self.count] = code
+            self.sums[code] += embedding
+            self.counts[code] += 1
+            self.total += embedding
+            self.total_sq += np.square(embedding, dtype=np.float64)
+            if self.ann is not None:
+                self.ann.add(self.count, embedding)
+            self.count += 1
+            if self.ann is None and self.count >= self.config['ann_threshold']:
+                self.build_index()
+            elif self.ann is not None and self.count >= 2 * self.ann.size:
+                self.build_index()
+
+    def fit(self, x, y, labels=None):
+        """
+        Enrol a batch of spectrograms with integer labels (into `labels`)
+        """
+        labels = labels if labels is not None else [str(i) for i in range(int(np.max(y)) + 1)]
+        self.labels.extend(label for label in labels if label not in self.labels)
+        features = self.features(x)
+        for embedding, code in zip(features, y):
+            self.add(None, labels[code], features=embedding)
+        return self
+
+    def weights(self):
+        """
+        Inverse variance of every feature over the enrolled samples
+        (from running sums)
+        """
+        if self.count < 2:
+            return np.ones(len(self.total), dtype=np.float32)
+        mean = self.total / self.count
+        variance = np.maximum(self.total_sq / self.count - mean * mean, 0)
+        return (1. / (variance + 1e-6)).astype(np.float32)
+
+    def build_index(self):
+        self.ann = CoarseIndex(
+            self.embeddings[:self.count], self.weights(),
+            n_probe=self.config['n_probe'], seed=self.config['seed'])
+
+    def distances(self, query, rows=None):
+        embeddings = self.embeddings[:self.count] if rows is None else self.embeddings[rows]
+        difference = embeddings - query
+        difference *= difference
+        return difference @ self.weights()
+
+    def classify(self, x):
+        """
+        Label probabilities (inverse distance weighted votes) of a
+        (bands, frames) spectrogram or a batch of them
+        """
+        features = self.features(x)
+        if features.ndim == 2:
+            return np.stack([self.query(f) for f in features])
+        return self.query(features)
+
+    def query(self, features):
+        with self.lock:
+            probabilities = np.zeros(self.n_labels)
+            if self.count == 0:
+                return probabilities
+            if self.mode == 'prototype':
+                present = np.flatnonzero(self.counts)
+                means = (self.sums[present] / self.counts[present, None]).astype(np.float32)
+                difference = means - features
+                d = (difference * difference) @ self.weights()
+                codes = present
+            else:
+                rows = self.ann.candidates(features) if self.ann is not None else None
+                if rows is not None and len(rows) == 0:
+                    rows = None
+                d = self.distances(features, rows)
+                k = min(self.k, len(d))
+                nearest = np.argpartition(d, k - 1)[:k]
+                codes = self.codes[nearest if rows is None else rows[nearest]]
+                d = d[nearest]
+            np.add.at(probabilities, codes, 1. / (d + 1e-6))
+        return probabilities / probabilities.sum()
+
+    def attach(self, dataset):
+        """
+        Enrol all the samples of a Dataset and every new one it records.
+        The class ids are the ones of the config.yml labels (what the MIDI
+        outputs are mapped to); dataset labels config.yml does not define
+        get the ids after them and send nothing.
+        """
+        self.labels = label_names()
+        samples = dataset.samples
+        if samples:
+            x = np.stack([sample.spectrogram if sample.spectrogram is not None
+                          else sample.create_spectrogram() for sample in samples])
+            for sample, embedding in zip(samples, self.features(x)):
+                self.add(None, sample.label, features=embedding)
+        dataset.subscribe(self.enrol)
+
+    def enrol(self, sample):
+        spectrogram = sample.spectrogram if sample.spectrogram is not None else sample.create_spectrogram()
+        self.add(spectrogram, sample.label)
+
+
+class CoarseIndex(object):
+    """
+    Inverted file index: the embeddings are assigned to `n_lists` k-means
+    centroids and a query only scans the rows of its `n_probe` closest lists
+    """
+    def __init__(self, embeddings, weights, n_lists=None, n_probe=4, iterations=10, seed=0):
+        self.size = len(embeddings)
+        self.scale = np.sqrt(weights).astype(np.float32)
+        self.n_probe = n_probe
+        points = embeddings * self.scale
+        n_lists = n_lists or max(1, int(np.sqrt(len(points))))
+        rng = np.random.RandomState(seed)
+        self.centroids = points[rng.choice(len(points), n_lists, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = self.assign(points)
+            for i in range(n_lists):
+                members = points[assignment == i]
+                if len(members):
+                    self.centroids[i] = members.mean(axis=0)
+        assignment = self.assign(points)
+        self.lists = [list(np.flatnonzero(assignment == i)) for i in range(n_lists)]
+
+    def assign(self, points):
+        d = (points * points).sum(axis=1)[:, None] - 2 * points @ self.centroids.T \
+            + (self.centroids * self.centroids).sum(axis=1)
+        return np.argmin(d, axis=1)
+
+    def add(self, row, embedding):
+        self.lists[int(self.assign((embedding * self.scale)[None])[0])].append(row)
+
+    def candidates(self, embedding):
+        point = embedding * self.scale
+        d = ((self.centroids - point) ** 2).sum(axis=1)
+        probe = np.argsort(d)[:self.n_probe]
+        return np.concatenate([np.asarray(self.lists[i], dtype=np.int64) for i in probe])
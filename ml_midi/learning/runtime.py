@@ -0,0 +1,155 @@
+import json
+import os
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+import ml_midi.config as config
+from .bundle import load_bundle, check_parameters, check_labels
+
+
+class NumpyConvNet(object):
+    """
+    TensorFlow-free forward pass of an exported or saved ConvNet
+    (see ConvNet.export and ConvNet.save).
+
+    Same layers as the TF graph: valid convolutions as im2col + one matmul,
+    max pooling, then bias and ReLU on the pooled activations (the same
+    result, on a quarter of the values), dense layers and a softmax. All
+    the intermediate arrays and im2col views are allocated once on load,
+    classify() of a single spectrogram only writes into them.
+    """
+    def __init__(self, weights, meta):
+        self.meta = meta
+        self.labels = list(meta['labels'])
+        self.input_shape = tuple(meta['input_shape'])
+        self.mean, self.std = meta['mean'], meta['std']
+        self.pool = meta['pool_size']
+        self.convs = [(weights['c{}.kernel'.format(i)], weights['c{}.bias'.format(i)], stride)
+                      for i, stride in enumerate(meta['strides'])]
+        self.dense = [(weights['fc{}.kernel'.format(i)], weights['fc{}.bias'.format(i)])
+                      for i in range(len(meta['fc_layers']))]
+        self.dense.append((weights['output.kernel'], weights['output.bias']))
+        self.allocate()
+
+    @classmethod
+    def load(cls, path=None, validate=True):
+        """
+        Load an exported .npz or a saved model bundle directory (weights
+        memory mapped), raises ValueError if it was trained with other
+        spectrogram settings or labels than the current config
+        """
+        path = path or config.MODEL_FILE
+        if os.path.isdir(path):
+            weights, meta = load_bundle(path, validate=validate)
+            return cls(dict(weights), meta)
+        with np.load(path) as data:
+            weights = {key: data[key].astype(np.float32) for key in data.files if key != 'meta'}
+            meta = json.loads(str(data['meta']))
+        if validate and 'fingerprint' in meta:
+            check_parameters(meta, path)
+            check_labels(meta, path)
+        return cls(weights, meta)
+
+    @property
+    def n_labels(self):
+        return len(self.labels)
+
+    def allocate(self):
+        """
+        Preallocate the activations of every layer for one input, with the
+        strided im2col view of each layer's input into them
+        """
+        h, w = self.input_shape
+        c = 1
+        self.input = np.empty((h, w, c), dtype=np.float32)
+        x = self.input
+        self.layers = []
+        for kernel, bias, stride in self.convs:
+            kh, kw, _, filters = kernel.shape
+            oh, ow = (h - kh) // stride + 1, (w - kw) // stride + 1
+            s0, s1, s2 = x.strides
+            patches = as_strided(x, shape=(oh, ow, kh, kw, c),
+                                 strides=(s0 * stride, s1 * stride, s0, s1, s2), writeable=False)
+            cols = np.empty((oh, ow, kh, kw, c), dtype=np.float32)
+            out = np.empty((oh, ow, filters), dtype=np.float32)
+            if self.pool > 1:
+                h, w = oh // self.pool, ow // self.pool
+                x = np.empty((h, w, filters), dtype=np.float32)
+            else:
+                h, w, x = oh, ow, out
+            self.layers.append((patches, cols, out, x, kernel.reshape(-1, filters), bias))
+            c = filters
+        self.hidden = [np.empty(kernel.shape[1], dtype=np.float32) for kernel, _ in self.dense]
+
+    def forward(self, spectrogram):
+        """
+        Class probabilities of one (bands, frames) spectrogram
+        """
+        np.subtract(spectrogram, self.mean, out=self.input[..., 0])
+        self.input /= self.std
+        p = self.pool
+        for patches, cols, out, pooled, kernel, bias in self.layers:
+            oh, ow, kh, kw, c = cols.shape
+            if c == 1:
+                # one channel: a copy per kernel offset beats the strided
+                # copy with its innermost axis of length 1
+                for i in range(kh):
+                    for j in range(kw):
+                        np.copyto(cols[:, :, i, j], patches[:, :, i, j])
+            else:
+                np.copyto(cols, patches)
+            np.matmul(cols.reshape(oh * ow, -1), kernel, out=out.reshape(oh * ow, -1))
+            if pooled is not out:
+                # max pooling commutes with the per filter bias and the ReLU,
+                # both run on the pooled activations
+                h, w, _ = pooled.shape
+                np.copyto(pooled, out[:h * p:p, :w * p:p])
+                for i in range(p):
+                    for j in range(p):
+                        if i or j:
+                            np.maximum(pooled, out[i:h * p:p, j:w * p:p], out=pooled)
+            pooled += bias
+            np.maximum(pooled, 0, out=pooled)
+        x = pooled.reshape(-1)
+
+        for i, ((kernel, bias), out) in enumerate(zip(self.dense, self.hidden)):
+            np.dot(x, kernel, out=out)
+            out += bias
+            if i < len(self.hidden) - 1:
+                np.maximum(out, 0, out=out)
+            x = out
+
+        x -= x.max()
+        np.exp(x, out=x)
+        x /= x.sum()
+        return x
+
+    def classify(self, x):
+        """
+        x is a (bands, frames) spectrogram or a batch of them, returns the
+        class probabilities (the returned array is reused by the next call)
+        """
+        x = np.asarray(x, dtype=np.float32)
+        if x.ndim == 2:
+            return self.forward(x)
+        return np.stack([self.forward(spectrogram).copy() for spectrogram in x])
+
+
+def load_classifier(path=None):
+    """
+    The model at path, default the saved bundle (config.MODEL_BUNDLE) or the
+    exported model (config.MODEL_FILE). While there is none, the random
+    RetardedClassifier. Raises ValueError if there are models but none of
+    them fits the current config, instead of running on random outputs.
+    """
+    paths = [path] if path else [config.MODEL_BUNDLE, config.MODEL_FILE]
+    errors = []
+    for path in paths:
+        if os.path.exists(path):
+            try:
+                return NumpyConvNet.load(path)
+            except ValueError as e:
+                errors.append(str(e))
+    if errors:
+        raise ValueError('\n'.join(errors))
+    from .naive import RetardedClassifier
+    return RetardedClassifier()
@@ -1,4 +1,18 @@
 from .audio import AudioIO
+from .buffer import RingBuffer
+from .backends import AudioBackend, PyAudioBackend, ReplayBackend
 from .data import DataIO, Dataset, DataSample
-from .process import scale, spectrogram, spectrogram_manual, melspectrogram, fft
-from .midi import Midi
\ No newline at end of file
+from .process import scale, spectrogram, spectrogram_manual, melspectrogram, melspectrogram_batch, fft
+from .spectral import SpectrogramEngine, mel_filterbank
+from .streaming import StreamingSpectrogram, window_features, onset_offset, find_onsets, event_windows, background_windows
+from .cache import FeatureCache
+from .store import PackedStore
+from .samples import SampleStore
+from .writer import BackgroundWriter
+from .midi import Midi, RawOutput
+from .midi_backends import MidiBackend, MidoBackend, LoopbackBackend, create_midi_backend
+from .outputs import Outputs, load_labels, class_names, no_event_class
+from .scheduler import MidiScheduler, velocity_from_amplitude
+from .inference import InferencePipeline, StreamingPipeline
+from .controller import MidiController, NNMidiController
+from .onset import OnsetDetector, EnvelopeDetector, SpectralFluxDetector, HFCDetector, create_detector
\ No newline at end of file
@@ -1,76 +1,97 @@
-import pyaudio
 import numpy as np
 import time
 import sys
-import scipy
-import wave, mido
 
 from ml_midi.config import audio_config
+from .buffer import RingBuffer
+from .backends import PyAudioBackend
 
 class AudioIO():
-    def __init__(self, channels=1, chunk_size=2048, 
-                 sample_rate=44100, device_index=1):
-
-        self.format = pyaudio.paInt16
+    def __init__(self, channels=1, chunk_size=2048,
+                 sample_rate=44100, device_index=1, buffer_length=None,
+                 backend=None):
+        """
+        backend: an AudioBackend, defaults to the sound card (PyAudioBackend)
+        """
         self.channels = channels
         self.sample_rate = sample_rate
         self.samples_per_chunk = chunk_size
         self.device_index = device_index
         self.detection_buffer_size = 256
+        self.buffer_length = buffer_length or 4 * sample_rate
+        self.buffer = None
+        self.capturing = False
+        self.capture_users = 0
 
-        self.instance = pyaudio.PyAudio() # create pyaudio instantiation
-        print(self.instance.get_sample_size(self.format))
-        self.input = self.instance.open(
-            format = self.format, 
-            rate = self.sample_rate,
-            channels = self.channels,
-            input_device_index = self.device_index,
-            input = True,
-            frames_per_buffer=self.samples_per_chunk)
-
-        self.output = self.instance.open(
-            format = self.format, 
-            rate = self.sample_rate,
-            channels = self.channels,
-            output = True)
+        self.backend = backend if backend is not None else PyAudioBackend()
+        self.backend.open(
+            channels=self.channels,
+            sample_rate=self.sample_rate,
+            device_index=self.device_index,
+            chunk_size=self.samples_per_chunk)
 
     def record(self, n_samples):
         """
-        Record n_samples
+        Record n_samples, returns a read-only int16 view of the device buffer
         """
         size = self.samples_per_chunk if n_samples is None else n_samples
-        raw = self.input.read(num_frames=size, exception_on_overflow=False)
-        data = np.fromstring(raw, dtype=np.int16)
+        return np.frombuffer(self.backend.read(size), dtype=np.int16)
 
-        return data, raw
-    
     def playback(self, wave):
-        self.output.start_stream()
-        self.output.write(wave)
-        self.output.stop_stream()
+        if isinstance(wave, np.ndarray):
+            wave = np.ascontiguousarray(wave, dtype=np.int16).tobytes()
+        self.backend.write(wave)
 
     def get_device_info(self):
-        info = self.instance.get_host_api_info_by_index(0)
-        m = ''
-        for i in range(info.get('deviceCount')):
-            if (self.instance.get_device_info_by_host_api_device_index(0, i).get('maxInputChannels')) > 0:
-                m += 'Input Device id: {}, {}\n'.format(i,self.instance.get_device_info_by_host_api_device_index(0, i).get('name'))
-                
-        return m
+        return self.backend.device_info()
+
+    def start_capture(self):
+        """
+        Switch the input to callback mode: the backend writes every chunk
+        into the ring buffer from its own thread, nothing blocks on read.
+        Every start_capture() needs its own stop_capture(), the capture
+        runs while anyone uses it.
+        """
+        self.capture_users += 1
+        if self.capturing:
+            return self.buffer
+        if self.buffer is None:
+            self.buffer = RingBuffer(self.buffer_length)
+        self.backend.start_callback(self.buffer.write)
+        self.capturing = True
+
+        return self.buffer
+
+    def stop_capture(self):
+        """
+        Release one start_capture(), returns to blocking reads once
+        nobody uses the capture anymore
+        """
+        self.capture_users = max(0, self.capture_users - 1)
+        if self.capture_users or not self.capturing:
+            return
+        self.backend.stop_callback()
+        self.capturing = False
+
+    def window(self, position, n_samples):
+        """
+        Zero-copy view of the captured samples starting at an absolute position
+        """
+        return self.buffer.view(position, n_samples)
 
     def start_recording(self):
-        self.input.start_stream()
+        self.backend.start()
 
     def pause(self):
-        self.input.stop_stream()
+        self.backend.stop()
 
     def close(self):
-        self.input.stop_stream()
-        self.input.close()
-        self.instance.terminate()
+        self.capture_users = 0
+        self.stop_capture()
+        self.backend.close()
 
 if __name__ == "__main__":
     p = AudioIO(**audio_config)
     for _ in range(10):
         samples_per_chunk = p.get_chunk()
-    p.data_output(samples_per_chunk)
\ No newline at end of file
+    p.data_output(samples_per_chunk)
@@ -0,0 +1,239 @@
+import numpy as np
+import threading
+import time
+import wave
+
+
+class AudioBackend(object):
+    """
+    Device layer behind AudioIO. Implementations deliver int16 mono/interleaved
+    audio either by blocking reads of n samples or by calling a callback with
+    every chunk of chunk_size samples from their own thread.
+    """
+    def open(self, channels, sample_rate, device_index, chunk_size):
+        self.channels = channels
+        self.sample_rate = sample_rate
+        self.device_index = device_index
+        self.chunk_size = chunk_size
+
+    def read(self, n_samples):
+        """
+        Blocking read, returns the raw int16 bytes of n_samples
+        """
+        raise NotImplementedError
+
+    def write(self, data):
+        """
+        Play back raw int16 bytes
+        """
+        raise NotImplementedError
+
+    def start_callback(self, callback):
+        """
+        Call callback(block) with an int16 array for every captured chunk
+        """
+        raise NotImplementedError
+
+    def stop_callback(self):
+        raise NotImplementedError
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def device_info(self):
+        return ''
+
+    def close(self):
+        pass
+
+
+class PyAudioBackend(AudioBackend):
+    """
+    Sound card input/output through PortAudio
+    """
+    def __init__(self):
+        import pyaudio
+        self.pyaudio = pyaudio
+        self.format = pyaudio.paInt16
+        self.instance = pyaudio.PyAudio()
+        self.input = None
+        self.output = None
+        self.callback = None
+
+    def open(self, channels, sample_rate, device_index, chunk_size):
+        super(PyAudioBackend, self).open(
+            channels, sample_rate, device_index, chunk_size)
+        self.input = self._open_input()
+        self.output = self.instance.open(
+            format = self.format,
+            rate = self.sample_rate,
+            channels = self.channels,
+            output = True)
+
+    def _open_input(self, callback=None):
+        return self.instance.open(
+            format = self.format,
+            rate = self.sample_rate,
+            channels = self.channels,
+            input_device_index = self.device_index,
+            input = True,
+            frames_per_buffer=self.chunk_size,
+            stream_callback=callback)
+
+    def read(self, n_samples):
+        return self.input.read(num_frames=n_samples, exception_on_overflow=False)
+
+    def write(self, data):
+        self.output.start_stream()
+        self.output.write(data)
+        self.output.stop_stream()
+
+    def start_callback(self, callback):
+        self.callback = callback
+        self.input.stop_stream()
+        self.input.close()
+        self.input = self._open_input(callback=self._stream_callback)
+        self.input.start_stream()
+
+    def stop_callback(self):
+        self.input.stop_stream()
+        self.input.close()
+        self.input = self._open_input()
+        self.callback = None
+
+    def _stream_callback(self, in_data, frame_count, time_info, status):
+        self.callback(np.frombuffer(in_data, dtype=np.int16))
+        return None, self.pyaudio.paContinue
+
+    def start(self):
+        self.input.start_stream()
+
+    def stop(self):
+        self.input.stop_stream()
+
+    def device_info(self):
+        info = self.instance.get_host_api_info_by_index(0)
+        m = ''
+        for i in range(info.get('deviceCount')):
+            if (self.instance.get_device_info_by_host_api_device_index(0, i).get('maxInputChannels')) > 0:
+                m += 'Input Device id: {}, {}\n'.format(i,self.instance.get_device_info_by_host_api_device_index(0, i).get('name'))
+
+        return m
+
+    def close(self):
+        self.input.stop_stream()
+        self.input.close()
+        self.instance.terminate()
+
+
+class ReplayBackend(AudioBackend):
+    """
+    Stand-in input device that streams WAV files or int16 arrays.
+
+    With realtime=True samples are delivered at the sample rate (reads and
+    callbacks are paced against the wall clock), otherwise as fast as the
+    consumer reads them. Callback mode has no way to wait for the consumer,
+    so it is only available in real time. Once the sources run out the input
+    delivers silence, or starts over if loop=True; `finished` is set at the
+    first end.
+    Played back audio is collected in `played`.
+    """
+    def __init__(self, sources, realtime=True, loop=False):
+        if isinstance(sources, (str, np.ndarray)):
+            sources = [sources]
+        self.data = np.concatenate([self._load(s) for s in sources])
+        self.realtime = realtime
+        self.loop = loop
+        self.position = 0
+        self.delivered = 0
+        self.started_at = None
+        self.finished = threading.Event()
+        self.played = []
+        self.callback = None
+        self.thread = None
+        self.running = False
+
+    @staticmethod
+    def _load(source):
+        if isinstance(source, np.ndarray):
+            return source.astype(np.int16, copy=False).ravel()
+        wavefile = wave.open(source, 'rb')
+        frames = wavefile.readframes(wavefile.getnframes())
+        wavefile.close()
+        return np.frombuffer(frames, dtype=np.int16)
+
+    def _next(self, n_samples):
+        """
+        Take the next n_samples from the sources, padded with silence or
+        wrapped around at the end
+        """
+        out = np.zeros(n_samples, dtype=np.int16)
+        filled = 0
+        while filled < n_samples:
+            remaining = len(self.data) - self.position
+            if remaining <= 0:
+                self.finished.set()
+                if not self.loop or len(self.data) == 0:
+                    break
+                self.position = 0
+                continue
+            n = min(remaining, n_samples - filled)
+            out[filled:filled+n] = self.data[self.position:self.position+n]
+            self.position += n
+            filled += n
+        return out
+
+    def _pace(self, n_samples):
+        """
+        Sleep until n_samples more would have arrived from a real device
+        """
+        if self.started_at is None:
+            self.started_at = time.perf_counter()
+        self.delivered += n_samples
+        if self.realtime:
+            due = self.started_at + self.delivered / float(self.sample_rate)
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+    def read(self, n_samples):
+        block = self._next(n_samples)
+        self._pace(n_samples)
+        return block.tobytes()
+
+    def write(self, data):
+        self.played.append(bytes(data))
+
+    def start_callback(self, callback):
+        if not self.realtime:
+            # the thread would lap the consumer's ring buffer and drop audio
+            raise ValueError('Callback capture needs a realtime replay, '
+                             'read a fast replay with blocking reads instead')
+        self.callback = callback
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while self.running:
+            block = self._next(self.chunk_size)
+            self._pace(self.chunk_size)
+            self.callback(block)
+
+    def stop_callback(self):
+        self.running = False
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+        self.thread = None
+        self.callback = None
+
+    def device_info(self):
+        return 'Replay device: {} samples, realtime: {}\n'.format(
+            len(self.data), self.realtime)
+
+    def close(self):
+        if self.running:
+            self.stop_callback()
@@ -0,0 +1,76 @@
+import numpy as np
+
+
+class RingBuffer(object):
+    """
+    Preallocated single-producer ring buffer of audio samples.
+
+    The storage is mirrored (every sample is written twice, capacity apart),
+    so any window of up to `capacity` samples is a contiguous slice and can be
+    returned as a zero-copy view. Positions are absolute sample counts since
+    the buffer was created; only the producer advances `written`, after the
+    data is in place, so readers never need a lock.
+    """
+    def __init__(self, capacity, dtype=np.int16):
+        self.capacity = int(capacity)
+        self.dtype = dtype
+        self.data = np.zeros(2 * self.capacity, dtype=dtype)
+        self.written = 0
+
+    def write(self, block):
+        """
+        Append a block of samples (called from the audio callback)
+        """
+        block = np.asarray(block, dtype=self.dtype)
+        n = len(block)
+        if n > self.capacity:
+            self.written += n - self.capacity
+            block, n = block[-self.capacity:], self.capacity
+
+        cap = self.capacity
+        start = self.written % cap
+        first = min(n, cap - start)
+        rest = n - first
+        self.data[start:start+first] = block[:first]
+        self.data[start+cap:start+cap+first] = block[:first]
+        if rest:
+            self.data[:rest] = block[first:]
+            self.data[cap:cap+rest] = block[first:]
+
+        self.written += n
+
+    def oldest(self):
+        """
+        Absolute position of the oldest sample still held in the buffer
+        """
+        return max(0, self.written - self.capacity)
+
+    def available(self, position):
+        """
+        Number of samples written since the absolute position
+        """
+        return self.written - position
+
+    def view(self, position, n_samples):
+        """
+        Zero-copy view of samples [position, position + n_samples).
+        Returns None if the range is not (or no longer) in the buffer.
+        The view is only valid until the producer laps it, copy it if it
+        has to outlive roughly capacity - n_samples new samples.
+        """
+        if n_samples > self.capacity or position < self.oldest() \
+                or position + n_samples > self.written:
+            return None
+        offset = position % self.capacity
+        return self.data[offset:offset+n_samples]
+
+    def latest(self, n_samples):
+        """
+        Zero-copy view of the most recent n_samples
+        """
+        n_samples = min(n_samples, self.written, self.capacity)
+        return self.view(self.written - n_samples, n_samples)
+
+    def clear(self):
+        self.data[:] = 0
+        self.written = 0
@@ -0,0 +1,186 @@
+import numpy as np
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+import ml_midi.config as config
+from .spectral import SpectrogramEngine
+from .writer import BackgroundWriter
+
+
+class FeatureCache(object):
+    """
+    Spectrogram cache keyed by (wave content hash, spectrogram parameter hash).
+
+    Recent entries are kept in memory in LRU order up to max_bytes; every
+    entry is also written to <directory>/<parameter hash>/<wave hash>.npy so
+    going back to a parameter set, or reopening a dataset, is a file read
+    instead of a recomputation. Returned arrays are read-only since they are
+    shared between callers.
+
+    put() only inserts in memory, the files are written by a BackgroundWriter
+    so callers on the detection path never wait on the disk. The files are
+    kept up to max_disk_bytes, least recently used ones are deleted first.
+    """
+    def __init__(self, directory=None, max_bytes=None, persist=True, max_disk_bytes=None):
+        self.directory = directory or config.CACHE_DIR
+        self.max_bytes = max_bytes or config.CACHE_BYTES
+        self.max_disk_bytes = max_disk_bytes or config.CACHE_DISK_BYTES
+        self.persist = persist
+        self.engine = SpectrogramEngine()
+        self.entries = OrderedDict()
+        self.size = 0
+        self.files = None
+        self.disk_size = 0
+        self.writer = None
+        self.hits, self.misses = 0, 0
+        self.lock = threading.Lock()
+        self.engine_lock = threading.Lock()
+
+    @staticmethod
+    def wave_key(wave):
+        wave = np.ascontiguousarray(wave)
+        digest = hashlib.blake2b(wave.view(np.uint8), digest_size=16)
+        digest.update(str(wave.dtype).encode())
+        return digest.hexdigest()
+
+    def parameter_key(self, normalize=False):
+        parameters = self.engine.parameters() + (normalize, self.engine.top_db)
+        return hashlib.blake2b(repr(parameters).encode(), digest_size=8).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[0], key[1] + '.npy')
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+
+        path = self.path(key)
+        if self.persist and os.path.isfile(path):
+            try:
+                value = np.load(path)
+            except (IOError, ValueError):
+                value = None # evicted meanwhile
+            if value is not None:
+                self._remember(key, value)
+                with self.lock:
+                    self.hits += 1
+                    if self.files is not None and path in self.files:
+                        self.files.move_to_end(path)
+                return value
+
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, value):
+        value = self._remember(key, np.array(value, dtype=np.float32))
+        if self.persist:
+            if self.writer is None:
+                self.writer = BackgroundWriter()
+            self.writer.submit(self._save, key, value)
+        return value
+
+    def _save(self, key, value):
+        """
+        Write one entry and evict old files (runs on the writer thread)
+        """
+        path = self.path(key)
+        folder = os.path.dirname(path)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        with open(path + '.tmp', 'wb') as f:
+            np.save(f, value)
+        os.replace(path + '.tmp', path)
+        if self.files is None:
+            self._scan()
+        size = os.path.getsize(path)
+        with self.lock:
+            self.disk_size += size - self.files.pop(path, 0)
+            self.files[path] = size
+            evicted = []
+            while self.disk_size > self.max_disk_bytes and len(self.files) > 1:
+                old, old_size = self.files.popitem(last=False)
+                self.disk_size -= old_size
+                evicted.append(old)
+        for old in evicted:
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+        return [] # a lost cache file is recomputed, no need to fsync
+
+    def _scan(self):
+        """
+        Index the files already on disk, oldest first
+        """
+        found = []
+        for folder, _, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith('.npy'):
+                    path = os.path.join(folder, name)
+                    stat = os.stat(path)
+                    found.append((stat.st_mtime, path, stat.st_size))
+        with self.lock:
+            self.files = OrderedDict((path, size) for _, path, size in sorted(found))
+            self.disk_size = sum(self.files.values())
+
+    def flush(self):
+        """
+        Block until every put() so far is on disk
+        """
+        if self.writer is not None:
+            self.writer.flush()
+
+    def _remember(self, key, value):
+        value.flags.writeable = False
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key).nbytes
+            self.entries[key] = value
+            self.size += value.nbytes
+            while self.size > self.max_bytes and len(self.entries) > 1:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= evicted.nbytes
+        return value
+
+    def spectrogram(self, wave, normalize=False):
+        """
+        Cached equivalent of process.melspectrogram
+        """
+        key = (self.parameter_key(normalize), self.wave_key(wave))
+        value = self.get(key)
+        if value is None:
+            with self.engine_lock:
+                value = self.engine.compute(wave, normalize=normalize)
+            value = self.put(key, value)
+        return value
+
+    def spectrogram_batch(self, waves, normalize=False):
+        """
+        Cached equivalent of process.melspectrogram_batch, only the
+        waves missing from the cache are computed (in one batch)
+        """
+        parameters = self.parameter_key(normalize)
+        keys = [(parameters, self.wave_key(wave)) for wave in waves]
+        values = [self.get(key) for key in keys]
+        missing = [i for i, value in enumerate(values) if value is None]
+        if missing:
+            with self.engine_lock:
+                computed = self.engine.compute_batch(
+                    np.asarray(waves)[missing], normalize=normalize)
+            for i, value in zip(missing, computed):
+                values[i] = self.put(keys[i], value)
+
+        return np.stack(values) if values else np.zeros((0,), dtype=np.float32)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
+cache = FeatureCache()
@@ -1,16 +1,169 @@
-import mido
+import os, time
+import numpy as np
+import ml_midi.config as config
+from .audio import AudioIO
+from .buffer import RingBuffer
+from .midi import Midi
+from .inference import InferencePipeline, StreamingPipeline
+
 
 class MidiController(object):
-    def __init__(self):
-        pass
+    """
+    Headless runtime, no GUI toolkit involved:
+
+        AudioIO capture -> InferencePipeline (detector, classifier) -> Midi
+
+    or, with streaming=True, a StreamingPipeline that classifies a rolling
+    window without onset detection (default config.STREAMING).
+
+    run() drives the pipeline in a tight polling loop on the calling thread,
+    start() runs it on its own thread instead. Anything interested in the
+    hits (the GUI, loggers) subscribes to the event stream with subscribe().
+    """
+    def __init__(self, classifier=None, audio=None, midi=None, detector=None, backend=None,
+                 streaming=None):
+        """
+        backend: AudioBackend for the default AudioIO (e.g. a ReplayBackend)
+        """
+        if classifier is None:
+            from ml_midi.learning import load_classifier
+            classifier = load_classifier()
+        self.classifier = classifier
+        self.audio = audio or AudioIO(backend=backend, **config.audio_config)
+        self.midi = midi or Midi()
+        self.detector = detector
+        self.streaming = config.STREAMING if streaming is None else streaming
+        self.observers = []
+        self.pipeline = None
+        self.capturing = False
+
+    def subscribe(self, callback):
+        """
+        callback(event) for every classified hit, see InferencePipeline
+        """
+        self.observers.append(callback)
+        if self.pipeline is not None:
+            self.pipeline.subscribe(callback)
+
+    def unsubscribe(self, callback):
+        self.observers.remove(callback)
+        if self.pipeline is not None:
+            self.pipeline.observers.remove(callback)
+
+    def _pipeline(self, buffer=None):
+        if buffer is None:
+            # the capture may be shared (e.g. with the record view), only
+            # the reference taken here is released by stop()
+            buffer = self.audio.start_capture()
+            self.capturing = True
+        try:
+            if self.streaming:
+                self.pipeline = StreamingPipeline(buffer, self.classifier, self.midi)
+            else:
+                self.pipeline = InferencePipeline(buffer, self.classifier, self.midi, detector=self.detector)
+        except ValueError:
+            self.stop()
+            raise
+        for callback in self.observers:
+            self.pipeline.subscribe(callback)
+        return self.pipeline
+
+    @property
+    def running(self):
+        return self.pipeline is not None and self.pipeline.running
+
+    def start(self):
+        """
+        Classify in the background
+        """
+        if self.pipeline is None:
+            self._pipeline().start()
+
+    def stop(self):
+        if self.pipeline is not None:
+            self.pipeline.stop()
+            self.pipeline = None
+        if self.capturing:
+            self.audio.stop_capture()
+            self.capturing = False
+
+    def run(self, duration=None, report_interval=None):
+        """
+        Classify on this thread until `duration` seconds passed, the replayed
+        input ran out or Ctrl-C, printing pipeline.report() every
+        `report_interval` seconds. Returns the timing stats.
+
+        A replay that is not realtime is read block by block on this thread
+        instead of through the capture callback, so every hit is processed
+        no matter how fast the file is consumed.
+        """
+        backend = self.audio.backend
+        offline = not getattr(backend, 'realtime', True)
+        if offline:
+            if self.audio.buffer is None:
+                self.audio.buffer = RingBuffer(self.audio.buffer_length)
+            pipeline = self._pipeline(self.audio.buffer)
+        else:
+            pipeline = self._pipeline()
+        finished = getattr(backend, 'finished', None)
+        start = last_report = time.perf_counter()
+        try:
+            pipeline.running = True
+            pipeline.reset()
+            while True:
+                if offline:
+                    pipeline.buffer.write(self.audio.record(self.audio.samples_per_chunk))
+                if pipeline.step() is not None:
+                    continue
+                now = time.perf_counter()
+                if duration is not None and now - start > duration:
+                    break
+                if finished is not None and finished.is_set() and pipeline.trigger is None \
+                        and pipeline.position >= pipeline.buffer.written:
+                    break
+                if report_interval and now - last_report > report_interval:
+                    print(pipeline.report())
+                    last_report = now
+                if not offline:
+                    time.sleep(config.POLL_INTERVAL)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            stats = pipeline.stats()
+            if report_interval:
+                print(pipeline.report())
+            self.stop()
+        return stats
+
+    def close(self):
+        self.stop()
+        self.audio.close()
+        self.midi.close()
+
 
 class NNMidiController(MidiController):
-    def __init__(self, net):
-        self.net = None
+    """
+    Controller with a trained network loaded by name
+    """
+    def __init__(self, net=None, **kwargs):
+        super(NNMidiController, self).__init__(classifier=net, **kwargs)
+        self.net = self.classifier
 
     def load_model(self, name):
-        pass
+        """
+        Load a saved model bundle or exported model, a path or a name
+        in config.MODEL_DIR
+        """
+        from ml_midi.learning import load_classifier
+        path = name if os.path.exists(name) else os.path.join(config.MODEL_DIR, name)
+        self.net = self.classifier = load_classifier(path)
+        if self.pipeline is not None:
+            self.pipeline.classifier = self.net
+        return self.net
 
     def read_input(self, input):
-        output = 0
-        return output
\ No newline at end of file
+        """
+        Class id of a (bands, frames) spectrogram
+        """
+        output = self.net.classify(input)
+        return int(np.argmax(output)) if np.ndim(output) else int(output)
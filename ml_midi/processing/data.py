@@ -1,40 +1,16 @@
 import numpy as np
 import time, datetime, os, sys
 import ml_midi.config as config
-import cv2, scipy, wave
-from PIL import Image
-import ml_midi.processing.process as ap
+import scipy, wave
+from .cache import cache
+from .store import PackedStore
+from .samples import SampleStore, DataSample
+from .writer import BackgroundWriter
+from .outputs import class_names
 import glob
+from concurrent.futures import ThreadPoolExecutor
 
 
-class DataSample(object):
-    def __init__(self, filename=None, wave=None, raw=None, label=None):
-        assert(filename is not None or wave is not None, 
-               'Must pass a either a wave array or a valid filename.')
-
-        if filename is None:
-            self.wave = wave
-            self.label = label
-        if wave is None:
-            self.wave, self.label = self.load_from_file(filename)
-
-        self.raw = raw
-        self.id = ''
-        self.spectrogram = None
-        # self.spectrogram = self.create_spectrogram()
-
-    def create_spectrogram(self):
-        spec = self.spectrogram = ap.melspectrogram(self.wave)
-        return spec
-
-    def from_wave(self, wave, label, dataset):
-        self.wave = wave
-        self.raw = None #!
-        self.spectrogram = None
-        self.label = label
-
-        return self
-
 class Category(object):
     def __init__(self):
         self.name = ''
@@ -48,90 +24,235 @@ class Category(object):
 
 class Dataset(object):
     """
-    Construct either from a folder or a list of wav files + labels
+    Construct either from a folder or a list of wav files + labels.
+    With packed=True the recordings live in a single PackedStore
+    (data/packed/<name>) instead of one wav file per sample.
+
+    Samples are rows of a columnar SampleStore, DataSample objects are
+    views created on request.
     """
-    def __init__(self, name, existing=False):
+    def __init__(self, name, existing=False, packed=None):
 
         self.name = name
-        self.labels, self.samples = [], []
-        self.hashmap, self.samples_per_label = {}, {}
+        self.samples_per_label = {}
 
         self.image_dir = os.path.join(config.DATA, 'images',name)
         self.audio_dir = os.path.join(config.DATA, 'audio', name)
+        self.packed_dir = os.path.join(config.PACKED_DIR, name)
+        if packed is None:
+            packed = config.PACKED_DATASETS or os.path.isdir(self.packed_dir)
+        self.packed = PackedStore(self.packed_dir) if packed else None
 
         self.current_sample_id = 0
         self.current_label = 'default'
 
-        self.n_labels = len(np.unique(self.labels))
         self.IO = DataIO()
+        self.store = SampleStore(reader=self.IO.read_wav)
+        self.executor = None
+        self.writer = None
+        self.observers = []
 
         if existing:
             self.load_existing()
-        else:
+        elif not os.path.isdir(self.audio_dir):
             os.makedirs(self.audio_dir)
 
+    @property
+    def labels(self):
+        return self.store.label_names
+
+    @property
+    def n_labels(self):
+        return len(self.store.label_names)
+
+    @property
+    def hashmap(self):
+        """
+        Label -> array of its sample rows
+        """
+        return self.store.label_index()
+
+    @property
+    def samples(self):
+        return [DataSample(self.store, row) for row in self.store.rows()]
+
     def get_sample(self, sample_no):
-        try:
-            return self.hashmap[self.current_label][sample_no]
-        except Exception as e:
-            print(e)
+        """
+        Sample of the current label by its id (the wav file name)
+        """
+        row = self.store.find(self.current_label, sample_no)
+        if row is None:
+            print('No sample {} in {}'.format(sample_no, self.current_label))
+            return None
+        return DataSample(self.store, row)
         
     def remove_sample(self, sample_no):
-        try:
-            self.hashmap[self.current_label].remove(sample_no)
-        except Exception as e:
-            print(e)
+        row = self.store.find(self.current_label, sample_no)
+        if row is not None:
+            self.store.remove(row)
 
     def new_label(self, name):
-        self.labels.append(name)
-        self.hashmap[name] = []
+        self.store.label_code(name)
         self.samples_per_label[name] = 0
         self.current_label = name
         os.makedirs(os.path.join(self.audio_dir, name))
+
+    def next_id(self, label, sample_id=None):
+        """
+        Ids count up per label, existing ids (file names) are kept
+        """
+        last = self.samples_per_label.get(label, 0)
+        if sample_id is None:
+            sample_id = last + 1
+        self.samples_per_label[label] = max(last, sample_id)
+        self.current_sample_id += 1
+        return sample_id
             
-    def new_sample(self, wave, bytestring=None, label=None, save=False):
+    def new_sample(self, wave, label=None, save=False):
         """
+        Add a recording, it is copied once into the sample store (so it can
+        be a view of the capture buffer). With save=True the stored row is
+        persisted by the background writer.
         """
-        new_sample = DataSample(wave=wave, raw=bytestring, label=label)
-
         if label is None:
             label = self.current_label
-        if label in self.hashmap.keys():
-            self.hashmap[label].append(new_sample)
-            self.samples_per_label[label] += 1
-        else:
-            self.hashmap[label] = [new_sample]
-            self.samples_per_label[label] = 1
-
-        new_sample.id = sid = self.samples_per_label[label]
-        self.samples.append(new_sample)
-        self.labels.append(label)
+        sid = self.next_id(label)
+        row = self.store.append(label, sid, wave=wave)
+        new_sample = DataSample(self.store, row)
+        for observer in self.observers:
+            observer(new_sample)
 
         if save:
-            folder = path = os.path.join(self.audio_dir, label)
-            if not os.path.isdir(folder):
-                os.makedirs(folder)
-
-            path = os.path.join(folder, str(sid)+'.wav')
-            self.IO.write_wav(
-                path=path, 
-                bytestring=bytestring)
-        self.current_sample_id += 1
+            if self.writer is None:
+                self.writer = BackgroundWriter()
+            self.writer.submit(self.persist, new_sample)
 
         return new_sample
 
+    def subscribe(self, callback):
+        """
+        callback(sample) is called with every new sample (e.g. to enrol it
+        in a PrototypeClassifier)
+        """
+        self.observers.append(callback)
+
+    def persist(self, sample):
+        """
+        Write one recording (runs on the writer thread), returns what to fsync
+        """
+        if sample.row < 0:
+            return []
+        wave, label, sample_id = sample.wave, sample.label, sample.id
+        if self.packed is not None:
+            self.packed.append(wave, label, sample_id=sample_id)
+            return [self.packed]
+
+        folder = os.path.join(self.audio_dir, label)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        path = os.path.join(folder, str(sample_id)+'.wav')
+        self.IO.write_wav(path=path, bytestring=wave)
+        return [path]
+
+    def flush(self):
+        """
+        Wait until all the recordings are on disk
+        """
+        if self.writer is not None:
+            self.writer.flush()
+
     def load_existing(self):
-        
+        """
+        Only builds the index (labels, ids, paths), the waves are read
+        on demand or by the background prefetch
+        """
+        if self.packed is not None:
+            return self.load_packed()
+
         subdirs = [x[0] for x in os.walk(self.audio_dir)][1:]
-        self.labels = [x.split('/')[-1] for x in subdirs]
+        labels = [x.split('/')[-1] for x in subdirs]
         self.current_label = 'default'
 
-        for i, subdir in enumerate(subdirs):
-            waves = self.IO.read_wav_directory(subdir)
-            for wave in waves:
-                sample = self.new_sample(wave=wave, label=self.labels[i])
+        files = [self.IO.list_wav_directory(subdir) for subdir in subdirs]
+        self.store.reserve(sum(len(f) for f in files) + 64)
+        for label, label_files in zip(labels, files):
+            self.store.label_code(label)
+            for path, sample_id in label_files:
+                self.store.append(label, self.next_id(label, sample_id), path=path)
+
+        self.prefetch()
+
+    def prefetch(self, rows=None):
+        """
+        Read the waves of the rows in a thread pool
+        """
+        if rows is None:
+            rows = self.store.unloaded()
+        if not len(rows):
+            return []
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=config.LOAD_WORKERS)
+        generation = self.store.generation
+        return [self.executor.submit(self.store.load, row, generation) for row in rows]
+
+    def load_all(self):
+        """
+        Block until every wave is in memory
+        """
+        for future in self.prefetch():
+            future.result()
 
+    def load_packed(self):
+        """
+        The wave matrix is the memory-mapped store itself
+        """
+        self.current_label = 'default'
+        self.store = SampleStore.from_packed(self.packed)
+        self.store.reader = self.IO.read_wav
+        for label, rows in self.store.label_index().items():
+            self.samples_per_label[label] = int(self.store.ids[rows].max()) if len(rows) else 0
 
+    def pack(self):
+        """
+        Convert the wav folder of this dataset into a packed store
+        """
+        self.packed = PackedStore.from_wav_folder(self.audio_dir, self.packed_dir)
+        return self.packed
+
+    def wave_matrix(self, length=None):
+        """
+        All sample waves as an (N, length) int16 array, padded or cut
+        to RECORDING_LENGTH by default
+        """
+        self.load_all()
+        return self.store.matrix(length=length or config.RECORDING_LENGTH)
+
+    def create_spectrograms(self, normalize=False):
+        """
+        Spectrograms of all the samples in one batched pass,
+        shape (N, FREQUENCY_BANDS, frames)
+        """
+        return cache.spectrogram_batch(self.wave_matrix(), normalize=normalize)
+
+    def training_data(self, normalize=None, labels=None):
+        """
+        Feature tensor (N, FREQUENCY_BANDS, frames) float32 and the class id
+        of every sample: its label's index in `labels`, by default the
+        config.yml label names (the ids the MIDI outputs are mapped to).
+        Raises ValueError for dataset labels that are not in `labels`.
+        """
+        normalize = config.NORMALIZE if normalize is None else normalize
+        labels = class_names() if labels is None else list(labels)
+        codes = self.store.codes[self.store.rows()]
+        names = self.store.label_names
+        missing = [names[code] for code in np.unique(codes) if names[code] not in labels]
+        if missing:
+            raise ValueError('Dataset labels {} are not defined in config.yml ({})'.format(
+                missing, labels))
+        class_ids = np.array([labels.index(name) if name in labels else -1 for name in names],
+                             dtype=np.int32)
+        x = self.create_spectrograms(normalize=normalize)
+        return x, class_ids[codes]
 
     def write_image_dataset(self):
         """
@@ -139,17 +260,17 @@ class Dataset(object):
         Using the current config
         """
         # Save the conf file somehow
-        dataset_folder = path = os.path.join(self.audio_dir, label)
+        dataset_folder = self.image_dir
+        images = self.create_spectrograms(normalize=True)
 
-        for sample in self.samples:
+        for sample, image in zip(self.samples, images):
 
             samples_folder = os.path.join(dataset_folder, sample.label)
             if not os.path.isdir(samples_folder):
                 os.makedirs(samples_folder)
 
-            path = os.path.join(samples_folder, sample.id+'.png')
-            image = sample.create_spectrogram()
-            self.IO.write_grayscale(path=path, image=image)
+            path = os.path.join(samples_folder, str(sample.id)+'.png')
+            self.IO.write_grayscale(path=path, image=(image * 255).astype(np.uint8))
 
     def split_data(self):
         """
@@ -161,16 +282,18 @@ class Dataset(object):
         self.test_labels = None
 
     def visualize(self, audio_engine):
+        import cv2
         w_name = 'Sample Display'
         cv2.namedWindow(w_name)
         cv2.resizeWindow(w_name, 600, 600)
         for sample in self.samples:
-            cv2.imshow(w_name, sample.spectrogram)
-            audio_engine.playback(sample.raw)
+            cv2.imshow(w_name, sample.create_spectrogram())
+            audio_engine.playback(sample.wave)
             cv2.waitKey(200)
         cv2.destroyWindow(w_name)
 
     def load_image_dataset(self, dataset):
+        from PIL import Image
         data, labels = [], []
         folder_path = os.path.join(self.data_dir, dataset)
         folders = os.listdir(folder_path)
@@ -187,7 +310,7 @@ class Dataset(object):
         return data, np.array(labels)
 
     def summary(self, print=False):
-        msg = 'Dataset: "{}", n: {}\n'.format(self.name, len(self.samples))
+        msg = 'Dataset: "{}", n: {}\n'.format(self.name, len(self.store))
         msg += '\nCategories   | samples:\n'
         for key in self.hashmap.keys():
             msg += '   {:10}: {}\n'.format(key, len(self.hashmap[key]))
@@ -202,12 +325,16 @@ class DataIO(object):
         pass
 
     def write_wav(self, path, bytestring, nchannels=1):
-    
+        """
+        bytestring: raw int16 bytes or an int16 array
+        """
         wavefile = wave.open(path, 'wb')
         wavefile.setnchannels(nchannels)
         wavefile.setsampwidth(2)
         wavefile.setframerate(config.SAMPLE_RATE)
-        wavefile.writeframes(bytestring)
+        wavefile.writeframes(memoryview(np.ascontiguousarray(bytestring)).cast('B')
+                             if isinstance(bytestring, np.ndarray) else bytestring)
+        wavefile.close()
 
     def read_wav(self, path):
         """
@@ -216,6 +343,17 @@ class DataIO(object):
         fs, data = scipy.io.wavfile.read(path)
         return data
 
+    def list_wav_directory(self, dir_path):
+        """
+        Returns (path, id) of the wav files in a directory, sorted by id
+        """
+        files = []
+        for path in glob.glob(os.path.join(dir_path, '*.wav')):
+            name = os.path.splitext(os.path.basename(path))[0]
+            files.append((path, int(name) if name.isdigit() else None))
+
+        return sorted(files, key=lambda f: (f[1] is None, f[1] or 0, f[0]))
+
     def read_wav_directory(self, dir_path):
         """
         Returns a list of np arrays of wav files
@@ -233,13 +371,15 @@ class DataIO(object):
         pass
 
     def write_grayscale(self, path, image):
+        from PIL import Image
         image = Image.fromarray(image).convert('L')
         image = image.transpose(Image.ROTATE_90)
-        print('Writing image sample to: {} \n'.format(location))
+        print('Writing image sample to: {} \n'.format(path))
         image.save(path)
 
     @staticmethod
     def write_image(self, image, dataset, label):
+        from PIL import Image
         timestamp = datetime.datetime.now().strftime('%m-%d_%H:%M:%S')
         image = Image.fromarray(image).convert('L')
         directory = os.path.join(self.data_dir, dataset, label)
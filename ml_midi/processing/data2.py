@@ -4,6 +4,7 @@ import ml_midi.config as config
 import cv2, scipy, wave
 from PIL import Image
 import ml_midi.processing.process as ap
+from .outputs import Outputs
 import glob
 
 
@@ -28,12 +29,13 @@ class Category(object):
         self.type = None
         self.function_args = {}
         self.function = None
+        self.outputs = ()
     
     def from_config(self, config):
         self.name = config['name']
-        self.type = config['type']
-        self.function_args = config['function_args']
-        self.function = Outputs
+        self.type = config.get('type', 'midi')
+        self.function_args = config.get('function_args', {})
+        self.outputs = Outputs.compile_label(config)
         
     def assign_output_function(self, ):
         self.function = function
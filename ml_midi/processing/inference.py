@@ -0,0 +1,368 @@
+import numpy as np
+import threading
+import time
+from collections import deque
+import ml_midi.config as config
+from .onset import create_detector
+from .spectral import SpectrogramEngine
+from .streaming import StreamingSpectrogram, window_features, onset_offset
+from .outputs import no_event_class
+
+
+class InferencePipeline(object):
+    """
+    Real-time path from the capture ring buffer to MIDI out, on its own thread:
+
+        onset detection -> window extraction -> spectrogram
+            -> classifier forward pass -> label to MIDI
+
+    Every hit is timed per stage. `processing` is the time from the last
+    sample of the window arriving in the buffer (estimated like the onset
+    time, so it includes the polling delay) to the MIDI message being sent,
+    `latency`
+    is the (estimated) time from the onset itself to MIDI out, which also
+    contains the RECORDING_LENGTH - PRE_TRIGGER samples it takes to fill
+    the window. Both are checked against LATENCY_TARGET in stats().
+    """
+    stages = ('detect', 'window', 'spectrogram', 'classify', 'output')
+
+    def __init__(self, buffer, classifier, midi=None, detector=None,
+                 window=None, pre_trigger=None, latency_target=None):
+        self.buffer = buffer
+        self.classifier = classifier
+        self.midi = midi
+        self.detector = detector or create_detector()
+        self.window = window or config.RECORDING_LENGTH
+        self.pre_trigger = config.PRE_TRIGGER if pre_trigger is None else pre_trigger
+        self.latency_target = latency_target or config.LATENCY_TARGET
+        self.sample_rate = config.SAMPLE_RATE
+
+        self.engine = SpectrogramEngine()
+        self.features = None
+        self.position = buffer.written
+        self.trigger = None
+        self.onset = None
+        self.onset_time = None
+        self.detect_time = 0.
+
+        self.events = deque(maxlen=config.STATS_WINDOW)
+        self.observers = []
+        self.running = False
+        self.thread = None
+
+    def subscribe(self, callback):
+        """
+        callback(event) is called on the pipeline thread after every hit
+        """
+        self.observers.append(callback)
+
+    def reset(self):
+        """
+        Start detecting from the newest sample
+        """
+        self.position = self.buffer.written
+        self.trigger = None
+        self.detector.reset()
+
+    def start(self):
+        self.reset()
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def _run(self):
+        while self.running:
+            if self.step() is None:
+                time.sleep(config.POLL_INTERVAL)
+
+    def sample_time(self, position):
+        """
+        Wall clock estimate of when a sample arrived, from the newest sample
+        """
+        return time.perf_counter() - (self.buffer.written - position) / float(self.sample_rate)
+
+    def step(self):
+        """
+        Consume what arrived in the buffer since the last call,
+        returns the event of a completed hit or None
+        """
+        if self.trigger is None:
+            self.position = max(self.position, self.buffer.oldest())
+            n = self.buffer.available(self.position)
+            if n <= 0:
+                return None
+            t0 = time.perf_counter()
+            onset = self.detector.process(self.buffer.view(self.position, n), self.position)
+            self.position += n
+            if onset is None:
+                return None
+            self.detect_time = time.perf_counter() - t0
+            self.onset_time = self.sample_time(onset)
+            self.onset = onset
+            self.trigger = max(self.buffer.oldest(), onset - self.pre_trigger)
+
+        if self.buffer.written < self.trigger + self.window:
+            return None
+        return self.classify()
+
+    def classify(self):
+        timings = dict(detect=self.detect_time)
+        t0 = time.perf_counter()
+        complete = self.sample_time(self.trigger + self.window)
+        window = self.buffer.view(self.trigger, self.window)
+        self.trigger = None
+        if window is None:
+            return None
+        t1 = time.perf_counter()
+        timings['window'] = t1 - t0
+
+        self.engine.prepare(self.window)
+        if self.features is None or self.features.shape != self.engine.shape:
+            self.features = np.empty(self.engine.shape, dtype=np.float32)
+        self.engine.compute(window, normalize=config.NORMALIZE, out=self.features)
+        t2 = time.perf_counter()
+        timings['spectrogram'] = t2 - t1
+
+        output = self.classifier.classify(self.features)
+        label = int(np.argmax(output)) if np.ndim(output) else int(output)
+        t3 = time.perf_counter()
+        timings['classify'] = t3 - t2
+
+        if self.midi is not None:
+            amplitude = max(int(window.max()), -int(window.min()))
+            self.midi.send_midi(label, amplitude=amplitude)
+        t4 = time.perf_counter()
+        timings['output'] = t4 - t3
+
+        event = dict(
+            onset=self.onset,
+            label=label,
+            output=np.copy(output), # classifiers may reuse their output array
+            timings=timings,
+            processing=t4 - complete,
+            latency=t4 - self.onset_time,
+            time=t4)
+        self.events.append(event)
+        for observer in self.observers:
+            observer(event)
+
+        return event
+
+    def stats(self):
+        """
+        Per stage and end-to-end timing summary over the last STATS_WINDOW
+        hits, in milliseconds
+        """
+        events = list(self.events)
+        if not events:
+            return {}
+
+        def summary(values):
+            values = 1000 * np.asarray(values)
+            return dict(
+                mean=float(values.mean()),
+                p50=float(np.percentile(values, 50)),
+                p99=float(np.percentile(values, 99)),
+                max=float(values.max()))
+
+        stats = {stage: summary([e['timings'][stage] for e in events]) for stage in self.stages}
+        for key in ('processing', 'latency'):
+            values = [e[key] for e in events]
+            stats[key] = summary(values)
+            stats[key]['over_target'] = float(np.mean(np.asarray(values) > self.latency_target))
+        stats['hits'] = len(events)
+        stats['target'] = 1000 * self.latency_target
+
+        return stats
+
+    def report(self):
+        stats = self.stats()
+        if not stats:
+            return 'No hits yet.\n'
+        msg = 'Hits: {}, target: {:.1f} ms\n'.format(stats['hits'], stats['target'])
+        for key in self.stages + ('processing', 'latency'):
+            s = stats[key]
+            msg += '   {:12}: mean {:7.3f}  p99 {:7.3f}  max {:7.3f} ms'.format(
+                key, s['mean'], s['p99'], s['max'])
+            if 'over_target' in s:
+                msg += '  over target: {:.0%}'.format(s['over_target'])
+            msg += '\n'
+        return msg
+
+
+class StreamingPipeline(InferencePipeline):
+    """
+    Classification without a trigger: a StreamingSpectrogram of the capture
+    buffer is kept up to date and every `stride` hops the classifier gets
+    the newest `frames` frames. The class posteriors are peak picked: the
+    best class other than the no-event one has to reach `threshold` and
+    stay the highest for `wait` more classifications, then it is sent and
+    nothing is picked for the next `refractory` seconds.
+
+    The window is trained with the onset at streaming.onset_offset() from
+    its start, so a hit is recognized once the window holds the samples up
+    to (frames - 1) * hop + n_fft past that point instead of after
+    RECORDING_LENGTH. The classifier has to be trained on windows of that
+    size plus a no-event class, see streaming.event_windows and
+    background_windows.
+    The no-event class is streaming_config['no_event'] or else the
+    config.yml label of `type: none`; without one, or with a classifier
+    that does not fit the windows, a ValueError is raised.
+    """
+    stages = ('spectrogram', 'window', 'classify', 'output')
+
+    def __init__(self, buffer, classifier, midi=None, streaming_config=None,
+                 pre_trigger=None, latency_target=None):
+        super(StreamingPipeline, self).__init__(
+            buffer, classifier, midi, pre_trigger=pre_trigger, latency_target=latency_target)
+        self.config = dict(config.streaming_config, **(streaming_config or {}))
+        self.frames = self.config['frames']
+        self.stride = self.config['stride']
+        self.threshold = self.config['threshold']
+        self.wait = self.config['wait']
+        self.no_event = self.config['no_event']
+        if self.no_event is None:
+            self.no_event = no_event_class()
+        if self.no_event is None:
+            raise ValueError('Streaming needs a no-event class: a config.yml label '
+                             'of type none, or streaming_config no_event')
+        self.stream = StreamingSpectrogram(buffer)
+        self.check_classifier()
+        self.key = None
+        self.windows = 0
+        self.update_time = 0.
+        self.reset()
+
+    def check_classifier(self):
+        """
+        Raise ValueError if the classifier does not take the streamed
+        (bands, frames) windows or has no class scores to peak pick
+        """
+        n_labels = getattr(self.classifier, 'n_labels', None)
+        if n_labels is None:
+            raise ValueError('Streaming needs a classifier with class scores, '
+                             '{} has none'.format(type(self.classifier).__name__))
+        if n_labels <= max(self.no_event, 1):
+            raise ValueError('Streaming needs the no-event class {} and at least one other, '
+                             'the classifier has {} classes'.format(self.no_event, n_labels))
+        shape = getattr(self.classifier, 'input_shape', None)
+        expected = (self.stream.bands, self.frames)
+        if shape is not None and tuple(shape) != expected:
+            raise ValueError('The classifier takes {} windows, streaming gives {} (bands, frames): '
+                             'train it on streaming windows'.format(tuple(shape), expected))
+
+    def reset(self):
+        self.stream.reset()
+        self.position = self.buffer.written
+        self.trigger = None
+        self.candidate = None
+        self.next = None
+        self.blocked = 0
+
+    def configure(self):
+        """
+        Frame counts of the window timing, after the stream was (re)built
+        """
+        self.key = self.stream.key
+        hop = self.stream.hop
+        self.onset_offset = onset_offset(hop, self.stream.n_fft, self.pre_trigger)
+        self.refractory = int(round(self.config['refractory'] * self.sample_rate / hop))
+        self.features = np.empty((self.stream.bands, self.frames), dtype=np.float32)
+        self.candidate, self.trigger, self.next, self.blocked = None, None, None, 0
+
+    def step(self):
+        """
+        Classify every window completed since the last call,
+        returns the event of a picked hit or None
+        """
+        t0 = time.perf_counter()
+        if self.stream.update():
+            self.update_time = time.perf_counter() - t0
+        if self.stream.key != self.key:
+            self.configure()
+
+        count = self.stream.count
+        first = max(self.frames, count - self.stream.history + self.frames)
+        self.next = first if self.next is None else max(self.next, first)
+        while self.next <= count:
+            end = self.next
+            self.next += self.stride
+            event = self.classify(end)
+            if event is not None:
+                return event
+        self.position = self.buffer.written
+        return None
+
+    def classify(self, end):
+        """
+        Classify the window of frames [end - frames, end) and pick peaks
+        """
+        t0 = time.perf_counter()
+        window = self.stream.view(end, self.frames)
+        if window is None:
+            return None
+        window_features(window, out=self.features)
+        t1 = time.perf_counter()
+        # a copy, classifiers may reuse their output array
+        output = np.array(self.classifier.classify(self.features), dtype=np.float64)
+        t2 = time.perf_counter()
+        self.windows += 1
+
+        scores = output.copy()
+        scores[self.no_event] = -1.
+        label = int(np.argmax(scores))
+        score = scores[label]
+        if score >= self.threshold and end >= self.blocked and \
+                (self.candidate is None or score > self.candidate['score']):
+            self.candidate = dict(label=label, score=score, end=end, output=output,
+                                  timings=dict(spectrogram=self.update_time, window=t1 - t0, classify=t2 - t1))
+            self.trigger = self.onset_position(end)
+        if self.candidate is None or end - self.candidate['end'] < self.wait * self.stride:
+            return None
+        return self.send(confirmed=end)
+
+    def onset_position(self, end):
+        """
+        Sample position of the onset in the window that ends at frame `end`
+        """
+        return self.stream.frame_position(end - self.frames) + self.onset_offset
+
+    def send(self, confirmed):
+        """
+        Send the picked candidate, `confirmed` is the end of the window
+        that confirmed it
+        """
+        candidate, self.candidate, self.trigger = self.candidate, None, None
+        end, label = candidate['end'], candidate['label']
+        self.blocked = end + self.refractory
+        onset = self.onset_position(end)
+        timings = candidate['timings']
+
+        t3 = time.perf_counter()
+        if self.midi is not None:
+            start = self.stream.frame_position(end - self.frames)
+            window = self.buffer.view(start, self.stream.frame_position(end - 1) + self.stream.n_fft - start)
+            amplitude = None if window is None else max(int(window.max()), -int(window.min()))
+            self.midi.send_midi(label, amplitude=amplitude)
+        t4 = time.perf_counter()
+        timings['output'] = t4 - t3
+
+        event = dict(
+            onset=onset,
+            label=label,
+            output=candidate['output'],
+            timings=timings,
+            processing=t4 - self.sample_time(self.stream.frame_position(confirmed - 1) + self.stream.n_fft),
+            latency=t4 - self.sample_time(onset),
+            time=t4)
+        self.events.append(event)
+        for observer in self.observers:
+            observer(event)
+
+        return event
@@ -1,32 +1,112 @@
 import mido, time
 import numpy as np
+import ml_midi.config as config
+from .outputs import Outputs
+from .midi_backends import MidiBackend, LoopbackBackend, create_midi_backend
+from .scheduler import MidiScheduler, velocity_from_amplitude
+
+
+class RawOutput(object):
+    """
+    Writes pre-encoded (status, data, data) tuples straight to the port
+    (MidiBackend.send_bytes, or the rtmidi handle of a mido port), skipping
+    mido.Message construction, validation and copying. Other ports get the
+    bytes decoded back into a mido.Message, which is correct but not faster.
+    """
+    def __init__(self, port):
+        self.port = port
+        rt = getattr(port, '_rt', None)
+        if isinstance(port, MidiBackend):
+            self.direct = port.raw
+            self.send = port.send_bytes
+        elif rt is not None and hasattr(rt, 'send_message'):
+            self.direct = True
+            self.send = rt.send_message
+        else:
+            self.direct = False
+            self.send = self._send_message
+
+    def _send_message(self, data):
+        self.port.send(mido.Message.from_bytes(data))
+
+    def close(self):
+        self.port.close()
+
 
 class Midi(object):
-    def __init__(self):
-        self.outputs = mido.get_output_names()
-        self.port = mido.open_output(self.outputs[0])
-        self.mapping = self.load_mapping(None)
+    def __init__(self, mapping=None, raw=None, backend=None):
+        """
+        raw: send pre-encoded bytes to the port (RawOutput) instead of
+        mido messages, default config.MIDI_RAW
+        backend: a MidiBackend, defaults to config.MIDI_BACKEND and falls
+        back to a LoopbackBackend when no MIDI output can be opened
+        """
+        if backend is None:
+            try:
+                backend = create_midi_backend()
+            except (IOError, ImportError) as e:
+                print('No MIDI output ({}), using a loopback port'.format(e))
+                backend = LoopbackBackend()
+        self.backend = backend
+        self.port = backend
+        self.raw = config.MIDI_RAW if raw is None else raw
+        if self.raw:
+            self.port = RawOutput(self.port)
+        self.mapping = self.load_mapping(mapping)
+        self.unmapped = set()
         self.channel = 1
+        self.scheduler = MidiScheduler(self.port)
 
     def load_mapping(self, mapping):
         """
-        Load a [classifier output<->midi message] hashmap config
+        Load a [classifier output<->midi message] table: an Outputs, a list
+        of label configs, a config.yml path or None for config.CONFIG_FILE
+        (the old fixed notes if it has no labels). It is compiled for the
+        kind of port in use (mido messages or raw bytes)
+        """
+        if isinstance(mapping, Outputs):
+            return mapping.encoded(self.raw)
+        if mapping is None or isinstance(mapping, str):
+            try:
+                mapping = Outputs.from_config(mapping, raw=self.raw)
+            except (IOError, ImportError) as e:
+                print('Could not read the label mapping: {}'.format(e))
+                mapping = None
+            if not mapping:
+                mapping = Outputs.from_notes([80, 20, 30, 40, 50], raw=self.raw)
+            return mapping
+        return Outputs(mapping, raw=self.raw)
+
+    def send_midi(self, msg_id, amplitude=None, gate=None):
+        """
+        Queue the output of a classifier output (class id) on the scheduler
+        thread. note_ons get their note_off `gate` seconds later and a
+        velocity from the hit amplitude (peak int16) when one is given.
+        Class ids without a label are reported once and otherwise ignored.
         """
-        mapping = {
-            '0' : self.create_message('note_on', 80, 100),
-            '1' : self.create_message('note_on', 20),
-            '2' : self.create_message('note_on', 30),
-            '3' : self.create_message('note_on', 40),
-            '4' : self.create_message('note_on', 50)}
-        return mapping
-
-    def send_midi(self, msg_id):
-        message = self.mapping[str(msg_id)]
-        self.port.send(message)
-        if message.type == 'note_on':
-            time.sleep(0.001)
-            off = mido.Message('note_off', note=message.note)
-            self.port.send(off)
+        table = self.mapping.table
+        if not 0 <= msg_id < len(table):
+            if msg_id not in self.unmapped:
+                self.unmapped.add(msg_id)
+                print('No output mapped to class {} ({} labels)'.format(msg_id, len(table)))
+            return
+        actions = table[msg_id]
+        velocity = None
+        if amplitude is not None and config.VELOCITY_FROM_AMPLITUDE:
+            velocity = velocity_from_amplitude(amplitude)
+
+        now = time.perf_counter()
+        for message, off, delay, note_gate in actions:
+            at = now + delay if delay else now
+            if off is None:
+                self.scheduler.schedule(message, at)
+                continue
+            if velocity is not None:
+                if self.raw:
+                    message = (message[0], message[1], velocity)
+                else:
+                    message = message.copy(velocity=velocity)
+            self.scheduler.note(message, off, gate=gate or note_gate, at=at)
 
     def create_message(self, type, b1, b2=64):
 
@@ -36,4 +116,7 @@ class Midi(object):
             velocity=b2)
         
         return message
-    
\ No newline at end of file
+
+    def close(self):
+        self.scheduler.stop()
+        self.port.close()
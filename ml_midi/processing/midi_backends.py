@@ -0,0 +1,124 @@
+import threading
+import time
+import mido
+import ml_midi.config as config
+
+
+class MidiBackend(object):
+    """
+    Output port behind Midi. send() takes a mido.Message, send_bytes() a
+    pre-encoded (status, data, data) tuple; backends that can write bytes
+    directly override it (and set raw), the default goes through mido.Message.
+    """
+    name = ''
+    raw = False
+
+    def send(self, message):
+        raise NotImplementedError
+
+    def send_bytes(self, data):
+        self.send(mido.Message.from_bytes(data))
+
+    def close(self):
+        pass
+
+
+class MidoBackend(MidiBackend):
+    """
+    A mido output port, by name or the first one available
+    """
+    def __init__(self, name=None):
+        names = mido.get_output_names()
+        if name is None:
+            if not names:
+                raise IOError('No MIDI output ports')
+            name = names[0]
+        self.port = mido.open_output(name)
+        self.name = self.port.name
+        self.send = self.port.send
+        rt = getattr(self.port, '_rt', None)
+        if rt is not None and hasattr(rt, 'send_message'):
+            self.send_bytes = rt.send_message
+            self.raw = True
+
+    def close(self):
+        self.port.close()
+
+
+class LoopbackBackend(MidiBackend):
+    """
+    In-process sink that records every message as (timestamp, bytes) with
+    time.perf_counter() timestamps, for tests and benchmarks without a MIDI
+    device. wait() blocks until a number of messages arrived.
+    """
+    name = 'loopback'
+    raw = True
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.messages = []
+        self.condition = threading.Condition()
+
+    def send(self, message):
+        self.send_bytes(message.bytes())
+
+    def send_bytes(self, data):
+        timestamp = self.clock()
+        with self.condition:
+            self.messages.append((timestamp, tuple(data)))
+            self.condition.notify_all()
+
+    def wait(self, n, timeout=None):
+        """
+        Block until at least n messages were recorded, returns False on timeout
+        """
+        with self.condition:
+            return self.condition.wait_for(lambda: len(self.messages) >= n, timeout)
+
+    def clear(self):
+        with self.condition:
+            self.messages = []
+
+    def decoded(self):
+        """
+        The recorded messages as (timestamp, mido.Message)
+        """
+        return [(t, mido.Message.from_bytes(data)) for t, data in self.messages]
+
+    def notes(self):
+        """
+        Recorded notes as (channel, note, velocity, on_time, off_time),
+        off_time is None for notes still sounding
+        """
+        notes, sounding = [], {}
+        for t, data in self.messages:
+            kind, key = data[0] & 0xF0, (data[0] & 0x0F, data[1])
+            if kind == 0x90 and data[2] > 0:
+                sounding[key] = len(notes)
+                notes.append([key[0], key[1], data[2], t, None])
+            elif kind == 0x80 or kind == 0x90:
+                i = sounding.pop(key, None)
+                if i is not None:
+                    notes[i][4] = t
+        return [tuple(note) for note in notes]
+
+    def latencies(self, times):
+        """
+        Delay of each note_on after the matching reference time in `times`
+        (e.g. the onset times of the hits), in seconds
+        """
+        ons = [note[3] for note in self.notes()]
+        return [on - t for on, t in zip(ons, times)]
+
+
+backends = dict(
+    mido=MidoBackend,
+    loopback=LoopbackBackend)
+
+
+def create_midi_backend(name=None, **kwargs):
+    """
+    MIDI output by name: 'mido' or 'loopback' (default config.MIDI_BACKEND)
+    """
+    name = config.MIDI_BACKEND if name is None else name
+    return backends[name](**kwargs)
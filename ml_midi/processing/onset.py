@@ -0,0 +1,209 @@
+import numpy as np
+import ml_midi.config as config
+
+
+class OnsetDetector(object):
+    """
+    Incremental onset detector working on blocks read from the ring buffer.
+
+    Blocks are cut into frames of `hop` samples (leftovers are carried over
+    to the next call) and one detection feature is computed per frame in a
+    single vectorized pass. A frame is an onset when its feature exceeds
+    max(threshold, ratio * noise floor), where the noise floor is an
+    exponential average of the feature over all the other frames, also the
+    ones in the `refractory` samples after an onset, in which detection is
+    suspended. The first `warmup` frames (after a reset) only set the floor,
+    nothing is detected in them. The DC offset is tracked with an
+    exponential average of the frame means (`dc_rate` per frame),
+    independent of the block size.
+    """
+    def __init__(self, hop=None, threshold=None, ratio=None, refractory=None,
+                 floor_decay=0.95, dc_rate=0.01, warmup=None):
+        self.hop = hop or config.DETECTION_SAMPLE_SIZE
+        self.threshold = config.THRESHOLD if threshold is None else threshold
+        self.ratio = config.ONSET_RATIO if ratio is None else ratio
+        self.refractory = config.RECORDING_LENGTH if refractory is None else refractory
+        self.floor_decay = floor_decay
+        self.dc_rate = dc_rate
+        self.warmup = config.ONSET_WARMUP if warmup is None else warmup
+        self.reset()
+
+    def reset(self):
+        self.pending = np.zeros(0, dtype=np.float32)
+        self.pending_position = None
+        self.floor = 0.
+        self.seen = 0
+        self.dc = None
+        self.limit = self.threshold
+        self.level = 0.
+        self.blocked_until = -1
+
+    def features(self, frames):
+        """
+        One detection value per frame, frames is (n_frames, hop) with DC removed
+        """
+        raise NotImplementedError
+
+    def process(self, block, position):
+        """
+        Feed a block of samples starting at the absolute sample `position`.
+        Returns the absolute sample offset of the first onset in it, or None.
+        """
+        if self.pending_position is None or \
+                self.pending_position + len(self.pending) != position:
+            # first block or a gap: nothing from before may leak into the frames
+            self.reset()
+            self.pending_position = position
+
+        samples = np.concatenate([self.pending, np.asarray(block, dtype=np.float32)])
+        n_frames = len(samples) // self.hop
+        start = self.pending_position
+        self.pending = samples[n_frames * self.hop:]
+        self.pending_position = start + n_frames * self.hop
+        if n_frames == 0:
+            return None
+
+        frames = samples[:n_frames * self.hop].reshape(n_frames, self.hop)
+        frames = frames - self.remove_dc(frames.mean(axis=1))[:, None]
+
+        values = self.features(frames)
+        self.level = values.max()
+        positions = start + self.hop * np.arange(n_frames)
+        warm = min(n_frames, max(0, self.warmup - self.seen))
+        if warm:
+            # plain mean while warming up, the floor does not start from 0
+            self.floor = (self.floor * self.seen + values[:warm].sum()) / (self.seen + warm)
+        self.seen += n_frames
+        self.limit = max(self.threshold, self.ratio * self.floor)
+        armed = positions > self.blocked_until
+        armed[:warm] = False
+        hits = np.flatnonzero((values > self.limit) & armed)
+
+        quiet = values[warm:]
+        if len(hits):
+            quiet = np.delete(values, hits[0])[warm:]
+        if len(quiet):
+            decay = self.floor_decay ** len(quiet)
+            self.floor = decay * self.floor + (1. - decay) * quiet.mean()
+
+        if not len(hits):
+            return None
+
+        frame = hits[0]
+        onset = int(positions[frame]) + self.locate(frames[frame])
+        self.blocked_until = onset + self.refractory
+        return onset
+
+    def remove_dc(self, means):
+        """
+        DC estimate after every frame, from the frame means: the one-pole
+        recursion dc = (1 - rate) * dc + rate * mean, in closed form over
+        chunks of frames
+        """
+        if self.dc is None:
+            self.dc = float(means[0])
+        rate = self.dc_rate
+        dc = np.empty(len(means))
+        for i in range(0, len(means), 64):
+            chunk = means[i:i + 64]
+            powers = (1. - rate) ** np.arange(1, len(chunk) + 1)
+            dc[i:i + 64] = powers * (self.dc + rate * np.cumsum(chunk / powers))
+            self.dc = float(dc[i + len(chunk) - 1])
+        return dc
+
+    def locate(self, frame):
+        """
+        Offset of the transient inside the triggering frame: the first sample
+        reaching half of the frame's peak amplitude
+        """
+        magnitude = np.abs(frame)
+        return int(np.argmax(magnitude >= 0.5 * magnitude.max()))
+
+
+class EnvelopeDetector(OnsetDetector):
+    """
+    Amplitude envelope, either the absolute 'peak' (both polarities)
+    or the 'rms' of each frame
+    """
+    def __init__(self, mode='peak', **kwargs):
+        self.mode = mode
+        super(EnvelopeDetector, self).__init__(**kwargs)
+
+    def features(self, frames):
+        if self.mode == 'rms':
+            return np.sqrt(np.mean(frames * frames, axis=1))
+        return np.abs(frames).max(axis=1)
+
+    def locate(self, frame):
+        if self.mode == 'peak':
+            return int(np.argmax(np.abs(frame) > self.limit))
+        return super(EnvelopeDetector, self).locate(frame)
+
+
+class SpectralDetector(OnsetDetector):
+    """
+    Base for detectors on the magnitude spectrum of overlapping windows of
+    n_fft samples ending at every hop
+    """
+    def __init__(self, n_fft=256, **kwargs):
+        self.n_fft = n_fft
+        self.window = np.hanning(n_fft).astype(np.float32)
+        self.scale = 2. / self.window.sum()
+        super(SpectralDetector, self).__init__(**kwargs)
+
+    def reset(self):
+        super(SpectralDetector, self).reset()
+        self.history = np.zeros(max(0, self.n_fft - self.hop), dtype=np.float32)
+        self.previous = None
+
+    def spectra(self, frames):
+        samples = np.concatenate([self.history, frames.ravel()])
+        if len(self.history):
+            self.history = samples[-len(self.history):].copy()
+        n_frames = len(frames)
+        index = self.hop * np.arange(n_frames)[:, None] + np.arange(self.n_fft)
+        if self.n_fft < self.hop:
+            index += self.hop - self.n_fft
+        windows = samples[index] * self.window
+        return np.abs(np.fft.rfft(windows, axis=1)) * self.scale
+
+
+class SpectralFluxDetector(SpectralDetector):
+    """
+    Positive magnitude differences between consecutive spectra, as the
+    root of their summed squares, in the same amplitude units as the
+    envelope detectors
+    """
+    def features(self, frames):
+        spectra = self.spectra(frames)
+        previous = spectra[0] if self.previous is None else self.previous
+        self.previous = spectra[-1]
+        diff = np.diff(np.vstack([previous[None], spectra]), axis=0)
+        np.maximum(diff, 0., out=diff)
+        return np.sqrt((diff * diff).sum(axis=1))
+
+
+class HFCDetector(SpectralDetector):
+    """
+    High frequency content: root of the energy weighted by the relative
+    bin index, in the same amplitude units as the envelope detectors
+    """
+    def features(self, frames):
+        spectra = self.spectra(frames)
+        n_bins = spectra.shape[1]
+        weights = np.arange(n_bins, dtype=np.float32) / n_bins
+        return np.sqrt((spectra * spectra) @ weights)
+
+
+detectors = dict(
+    peak=lambda **kwargs: EnvelopeDetector(mode='peak', **kwargs),
+    rms=lambda **kwargs: EnvelopeDetector(mode='rms', **kwargs),
+    flux=SpectralFluxDetector,
+    hfc=HFCDetector)
+
+def create_detector(method=None, **kwargs):
+    """
+    Detector by name: 'peak', 'rms', 'flux' or 'hfc' (default config.ONSET_METHOD)
+    """
+    method = config.ONSET_METHOD if method is None else method
+    return detectors[method](**kwargs)
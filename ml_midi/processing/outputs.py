@@ -1,12 +1,124 @@
+import re
+import mido
+import ml_midi.config as config
+
+
+def load_labels(path=None):
+    """
+    The `labels` section of config.yml as a list ordered by class id
+    (label0, label1, ...)
+    """
+    import yaml
+    with open(path or config.CONFIG_FILE) as f:
+        labels = (yaml.safe_load(f) or {}).get('labels') or {}
+    if isinstance(labels, list):
+        return labels
+
+    def class_id(key):
+        match = re.search(r'\d+$', str(key))
+        return int(match.group()) if match else len(labels)
+    return [labels[key] for key in sorted(labels, key=class_id)]
+
+
+def class_names(labels=None):
+    """
+    Names of the labels (default: of config.yml) in class id order
+    """
+    labels = load_labels() if labels is None else labels
+    return [label.get('name', str(i)) for i, label in enumerate(labels)]
+
+
+def no_event_class(labels=None):
+    """
+    Class id of the first label of `type: none` (default: of config.yml),
+    None if there is none
+    """
+    labels = load_labels() if labels is None else labels
+    for class_id, label in enumerate(labels):
+        if label.get('type') == 'none':
+            return class_id
+    return None
 
 
 class Outputs(object):
     """
-    Contains all the functions for sending outputs
-    based on classification outcome
+    The label -> output mapping compiled into a dense dispatch table.
+
+    table[class_id] is a tuple of actions (message, note_off, delay, gate),
+    with the mido messages prebuilt once: note_off is None for anything
+    that is not a note. A label either describes a single message
+
+        label0: {name: tap, type: midi, msg: note_on, note: 36, velocity: 100}
+
+    or a chain of them under `outputs`, sent in order (each one optionally
+    `delay` seconds after the hit):
+
+        label1:
+          name: snap
+          outputs:
+            - {msg: note_on, note: 38, gate: 0.2}
+            - {msg: control_change, control: 1, value: 127}
+            - {msg: program_change, program: 4, delay: 0.5}
+
+    Missing fields take mido's defaults (channel 0, velocity 64, ...).
+    With raw=True the messages are pre-encoded to tuples of status/data
+    bytes for ports that are written to directly (see RawOutput).
     """
-    def __init__(self):
-        pass
+    fields = ('channel', 'note', 'velocity', 'control', 'value', 'program', 'pitch')
+
+    def __init__(self, labels=None, raw=False):
+        self.raw = raw
+        labels = load_labels() if labels is None else labels
+        if isinstance(labels, dict):
+            labels = [labels[key] for key in sorted(labels)]
+        self.labels = list(labels)
+        self.names = class_names(self.labels)
+        self.table = [self.compile_label(label, raw) for label in self.labels]
+
+    @classmethod
+    def from_config(cls, path=None, raw=False):
+        return cls(load_labels(path), raw)
+
+    @classmethod
+    def from_notes(cls, notes, velocity=64, raw=False):
+        """
+        One note_on per class id
+        """
+        return cls([dict(msg='note_on', note=note, velocity=velocity) for note in notes], raw)
+
+    def encoded(self, raw=True):
+        """
+        The same mapping compiled for mido ports (raw=False) or raw ports
+        """
+        return self if raw == self.raw else Outputs(self.labels, raw)
+
+    @classmethod
+    def compile_label(cls, label, raw=False):
+        if label.get('type', 'midi') != 'midi':
+            return ()
+        outputs = label.get('outputs') or [label]
+        return tuple(cls.compile_output(output, raw) for output in outputs)
+
+    @classmethod
+    def compile_output(cls, output, raw=False):
+        kind = output.get('msg', 'note_on')
+        kwargs = {key: output[key] for key in cls.fields if key in output}
+        message = mido.Message(kind, **kwargs)
+        off = None
+        if kind == 'note_on':
+            off = mido.Message('note_off', note=message.note, channel=message.channel)
+        if raw:
+            message = tuple(message.bytes())
+            off = tuple(off.bytes()) if off is not None else None
+        return (message, off, float(output.get('delay', 0.)), output.get('gate'))
+
+    def __getitem__(self, class_id):
+        return self.table[class_id]
+
+    def __len__(self):
+        return len(self.table)
 
-    def send_midi(self):
-        pass
\ No newline at end of file
+    def __repr__(self):
+        return 'Outputs({})'.format(', '.join(
+            '{}: {}'.format(name, ' + '.join(str(action[0]) for action in actions))
+            for name, actions in zip(self.names, self.table)))
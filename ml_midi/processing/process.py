@@ -3,6 +3,7 @@ import scipy
 import librosa
 import math
 import ml_midi.config as config
+from .spectral import engine
 
 
 def spectrogram_manual(wave, bins):
@@ -40,22 +41,17 @@ def mfcc(wave=None, spectrogram=None):
     return mfcc
 
 def melspectrogram(wave, normalize=False):
-    hop_length = config.RECORDING_LENGTH // (config.TIMESTEPS + 1)
-    config.melspectrogram['hop_length'] = hop_length
-    wave = wave.astype(np.float32)
-    mel = librosa.feature.melspectrogram(
-        y=wave,
-        hop_length=hop_length,
-        sr=config.SAMPLE_RATE, 
-        n_fft=config.FFT_LENGTH,
-        fmin=config.SPECTROGRAM_LOW,
-        fmax=config.SPECTROGRAM_HIGH,
-        n_mels=config.FREQUENCY_BANDS)
-
-    decibels = librosa.power_to_db(mel)
-    if normalize: decibels = scale(decibels)
+    """
+    Mel spectrogram in dB, shape (FREQUENCY_BANDS, frames)
+    """
+    return engine.compute(wave, normalize=normalize)
 
-    return decibels
+def melspectrogram_batch(waves, normalize=False, chunk_size=None):
+    """
+    Mel spectrograms of an (N, RECORDING_LENGTH) stack of waves,
+    shape (N, FREQUENCY_BANDS, frames)
+    """
+    return engine.compute_batch(waves, normalize=normalize, chunk_size=chunk_size)
     
 def scale(wave):
     """
@@ -0,0 +1,310 @@
+import numpy as np
+import threading
+import ml_midi.config as config
+from .cache import cache
+
+
+class SampleStore(object):
+    """
+    Columnar container of all the samples of a dataset:
+
+        base     read-only (n, length) int16 matrix of the first rows, the
+                 memmap of a PackedStore (or None)
+        waves    (rows, length) int16 matrix of the rows after the base
+        lengths  number of valid samples in each row
+        codes    integer label code per row (index into label_names)
+        ids      sample id per row (the wav file name)
+        alive    False for removed rows (tombstones)
+        loaded   False while the wave of a lazily indexed file is unread
+
+    Rows are appended at the end (the columns grow by doubling), so adding
+    to a packed dataset never copies its memmap. Waves longer than `length`
+    widen the matrix. Removal only clears `alive`, and compact() drops the
+    tombstones once they make up more than COMPACT_RATIO of the rows.
+    Per-label row indexes are cached and rebuilt after a change.
+    """
+    def __init__(self, length=None, capacity=64, reader=None):
+        self.length = length or config.RECORDING_LENGTH
+        self.reader = reader
+        self.label_names = []
+        self.count = 0
+        self.removed = 0
+        self.generation = 0
+        self.moves = []
+        self.paths = {}
+        self.base = None
+        self.base_count = 0
+        self.lock = threading.Lock()
+        self.waves = np.zeros((capacity, self.length), dtype=np.int16)
+        for name, column in zip(self.columns, self._empty(capacity)):
+            setattr(self, name, column)
+        self._label_index = None
+
+    columns = ('lengths', 'codes', 'ids', 'alive', 'loaded')
+
+    def _empty(self, capacity):
+        return (np.zeros(capacity, dtype=np.int32),
+                np.full(capacity, -1, dtype=np.int16),
+                np.zeros(capacity, dtype=np.int32),
+                np.zeros(capacity, dtype=bool),
+                np.zeros(capacity, dtype=bool))
+
+    def __len__(self):
+        return self.count - self.removed
+
+    @property
+    def capacity(self):
+        return len(self.codes)
+
+    def reserve(self, capacity):
+        """
+        Make room for at least `capacity` rows
+        """
+        with self.lock:
+            if capacity > self.capacity:
+                self._grow_columns(capacity)
+            if capacity - self.base_count > len(self.waves):
+                self._grow_waves(capacity - self.base_count, self.length)
+
+    # the _grow methods run under the lock; they fill the new arrays before
+    # swapping them in, readers on other threads keep seeing complete data
+
+    def _grow_columns(self, capacity):
+        columns = self._empty(capacity)
+        for name, column in zip(self.columns, columns):
+            column[:self.count] = getattr(self, name)[:self.count]
+        for name, column in zip(self.columns, columns):
+            setattr(self, name, column)
+
+    def _grow_waves(self, rows, length):
+        waves = np.zeros((rows, length), dtype=np.int16)
+        n, width = self.count - self.base_count, min(length, self.length)
+        waves[:n, :width] = self.waves[:n, :width]
+        self.waves, self.length = waves, length
+
+    def label_code(self, label):
+        if label not in self.label_names:
+            self.label_names.append(label)
+        return self.label_names.index(label)
+
+    def append(self, label, sample_id, wave=None, path=None):
+        """
+        Add a row, either with its wave or with the path it is loaded from later
+        """
+        with self.lock:
+            row = self.count
+            if row == self.capacity:
+                self._grow_columns(max(64, 2 * self.capacity))
+            if row - self.base_count == len(self.waves):
+                self._grow_waves(max(64, 2 * len(self.waves)), self.length)
+            self.codes[row] = self.label_code(label)
+            self.ids[row] = sample_id
+            self.alive[row] = True
+            if wave is not None:
+                self._write(row, wave)
+            else:
+                self.paths[row] = path
+            self._label_index = None
+            self.count += 1
+
+        return row
+
+    def _write(self, row, wave):
+        """
+        Set the wave of a row after the base (under the lock)
+        """
+        wave = np.asarray(wave)
+        if len(wave) > self.length:
+            self._grow_waves(len(self.waves), len(wave))
+        target = self.waves[row - self.base_count]
+        target[:len(wave)] = wave
+        target[len(wave):] = 0
+        self.lengths[row] = len(wave)
+        self.loaded[row] = True
+
+    def load(self, row, generation=None):
+        """
+        Read the wave of a lazily indexed row with reader(path). A row
+        number taken at an older `generation` is translated first, also
+        if the store is compacted while the file is read.
+        """
+        with self.lock:
+            if generation is not None:
+                row = self.translate(row, generation)
+            generation = self.generation
+            if row < 0 or self.loaded[row]:
+                return
+            path = self.paths[row]
+        wave = self.reader(path)
+        with self.lock:
+            row = self.translate(row, generation)
+            if row >= 0 and not self.loaded[row]:
+                self._write(row, wave)
+
+    def wave(self, row):
+        """
+        Zero-copy view of the valid part of a row
+        """
+        if not self.loaded[row]:
+            self.load(row)
+        if row < self.base_count:
+            return self.base[row, :self.lengths[row]]
+        return self.waves[row - self.base_count, :self.lengths[row]]
+
+    def label(self, row):
+        return self.label_names[self.codes[row]]
+
+    def remove(self, row):
+        with self.lock:
+            if not self.alive[row]:
+                return
+            self.alive[row] = False
+            self.removed += 1
+            self._label_index = None
+            full = self.removed > config.COMPACT_RATIO * self.count
+        if full:
+            self.compact()
+
+    def compact(self):
+        """
+        Drop the removed rows, returns the old -> new row mapping (-1 if removed).
+        The rows of a packed base are copied into memory.
+        """
+        with self.lock:
+            keep = np.flatnonzero(self.alive[:self.count])
+            mapping = np.full(self.count, -1, dtype=np.int64)
+            mapping[keep] = np.arange(len(keep))
+            waves = np.zeros((max(64, len(keep)), self.length), dtype=np.int16)
+            waves[:len(keep)] = self._gather(keep, self.length)
+            for name in self.columns:
+                column = getattr(self, name)
+                column[:len(keep)] = column[keep]
+                column[len(keep):self.count] = 0
+            self.codes[len(keep):self.count] = -1
+            self.waves, self.base, self.base_count = waves, None, 0
+            self.paths = {mapping[row]: path for row, path in self.paths.items()
+                          if mapping[row] >= 0}
+            self.count, self.removed = len(keep), 0
+            self.moves.append(mapping)
+            self.generation += 1
+            self._label_index = None
+
+        return mapping
+
+    def translate(self, row, generation):
+        """
+        Current row of a row number taken at an older generation (-1 if removed)
+        """
+        for mapping in self.moves[generation:]:
+            if row < 0:
+                break
+            row = mapping[row]
+        return row
+
+    def label_index(self):
+        """
+        Dict of label -> array of its alive rows
+        """
+        index = self._label_index
+        if index is None:
+            with self.lock:
+                codes = self.codes[:self.count]
+                alive = self.alive[:self.count]
+                index = self._label_index = {
+                    name: np.flatnonzero((codes == code) & alive)
+                    for code, name in enumerate(self.label_names)}
+        return index
+
+    def rows(self, label=None):
+        if label is None:
+            return np.flatnonzero(self.alive[:self.count])
+        return self.label_index().get(label, np.zeros(0, dtype=np.int64))
+
+    def find(self, label, sample_id):
+        rows = self.rows(label)
+        match = rows[self.ids[rows] == sample_id]
+        return int(match[0]) if len(match) else None
+
+    def unloaded(self):
+        return np.flatnonzero(self.alive[:self.count] & ~self.loaded[:self.count])
+
+    def matrix(self, rows=None, length=None):
+        """
+        (n, length) wave matrix of the given (default: all alive) rows
+        """
+        rows = self.rows() if rows is None else np.asarray(rows)
+        length = length or self.length
+        if self.base is None and length == self.length:
+            return self.waves[rows]
+        return self._gather(rows, length)
+
+    def _gather(self, rows, length):
+        waves = np.zeros((len(rows), length), dtype=np.int16)
+        in_base = rows < self.base_count
+        if in_base.any():
+            n = min(length, self.base.shape[1])
+            waves[in_base, :n] = self.base[rows[in_base], :n]
+        tail = ~in_base
+        if tail.any():
+            n = min(length, self.length)
+            waves[tail, :n] = self.waves[rows[tail] - self.base_count, :n]
+        return waves
+
+    @classmethod
+    def from_packed(cls, packed):
+        """
+        Wrap a PackedStore without copying: its memmap is the base of the
+        wave matrix, new rows go to the (in memory) rows after it
+        """
+        store = cls(length=packed.length, capacity=0)
+        index = packed.index
+        store.label_names = list(packed.labels)
+        store.base = packed.waves
+        store.base_count = len(index)
+        store.lengths = np.array(index['length'], dtype=np.int32)
+        store.codes = np.array(index['label'], dtype=np.int16)
+        store.ids = np.array(index['id'], dtype=np.int32)
+        store.alive = np.ones(len(index), dtype=bool)
+        store.loaded = np.ones(len(index), dtype=bool)
+        store.count = len(index)
+        return store
+
+
+class DataSample(object):
+    """
+    Lightweight view of one row of a SampleStore
+    """
+    __slots__ = ('store', '_row', 'generation', 'spectrogram')
+
+    def __init__(self, store, row):
+        self.store = store
+        self._row = row
+        self.generation = store.generation
+        self.spectrogram = None
+
+    @property
+    def row(self):
+        if self.generation != self.store.generation:
+            self._row = self.store.translate(self._row, self.generation)
+            self.generation = self.store.generation
+        return self._row
+
+    @property
+    def wave(self):
+        return self.store.wave(self.row)
+
+    @property
+    def label(self):
+        return self.store.label(self.row)
+
+    @property
+    def id(self):
+        return int(self.store.ids[self.row])
+
+    @property
+    def loaded(self):
+        return bool(self.store.loaded[self.row])
+
+    def create_spectrogram(self):
+        spec = self.spectrogram = cache.spectrogram(self.wave)
+        return spec
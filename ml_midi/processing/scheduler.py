@@ -0,0 +1,136 @@
+import heapq
+import itertools
+import threading
+import time
+import ml_midi.config as config
+
+
+def velocity_from_amplitude(amplitude, floor=None, ceiling=32767, curve=0.5):
+    """
+    Map a peak int16 amplitude to a MIDI velocity in [1, 127],
+    on a power curve between the detection threshold and full scale
+    """
+    floor = config.THRESHOLD if floor is None else floor
+    level = (float(amplitude) - floor) / float(ceiling - floor)
+    level = min(max(level, 0.), 1.)
+    return int(round(1 + 126 * level ** curve))
+
+
+def voice(message):
+    """
+    (channel, note) of a mido note message or a raw (status, note, velocity) tuple
+    """
+    if isinstance(message, tuple):
+        return (message[0] & 0x0F, message[1])
+    return (message.channel, message.note)
+
+
+class MidiScheduler(object):
+    """
+    Sends MIDI messages from a dedicated thread at their due time, kept in a
+    heap ordered by (time, submission order). Callers only push onto the
+    heap, so scheduling is O(log n) and never sleeps on their thread.
+
+    note() sends a note_on now and its note_off after `gate` seconds. A
+    retrigger of a sounding note within `retrigger` seconds of its note_on
+    is coalesced (the note is only held longer); a later retrigger closes
+    the sounding note first so note_on/note_off pairs never overlap.
+
+    Messages are passed to port.send() as they are, mido messages or raw
+    byte tuples for a RawOutput.
+    """
+    def __init__(self, port, gate=None, retrigger=None):
+        self.port = port
+        self.gate = config.GATE_LENGTH if gate is None else gate
+        self.retrigger = config.RETRIGGER_TIME if retrigger is None else retrigger
+        self.heap = []
+        self.counter = itertools.count()
+        self.cancelled = set()
+        self.sounding = {}
+        self.condition = threading.Condition()
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def schedule(self, message, at=None):
+        """
+        Send message at time `at` (time.perf_counter(), default now),
+        returns a token for cancel()
+        """
+        at = time.perf_counter() if at is None else at
+        token = next(self.counter)
+        with self.condition:
+            heapq.heappush(self.heap, (at, token, message))
+            if self.heap[0][1] == token:
+                self.condition.notify()
+        return token
+
+    def cancel(self, token):
+        with self.condition:
+            self.cancelled.add(token)
+
+    def note(self, on, off, key=None, gate=None, at=None):
+        """
+        Schedule a note_on message and its matching note_off after `gate`
+        seconds. key identifies the voice (default: (channel, note) of `on`)
+        """
+        now = time.perf_counter() if at is None else at
+        gate = self.gate if gate is None else gate
+        key = voice(on) if key is None else key
+
+        with self.condition:
+            sounding = self.sounding.get(key)
+            if sounding is not None and sounding[1] > now:
+                off_token, off_time, on_time = sounding
+                self.cancelled.add(off_token)
+                if now - on_time < self.retrigger:
+                    token = self._push(now + gate, off)
+                    self.sounding[key] = (token, now + gate, on_time)
+                    return
+                self._push(now, off)
+
+            self._push(now, on)
+            token = self._push(now + gate, off)
+            self.sounding[key] = (token, now + gate, now)
+            self.condition.notify()
+
+    def _push(self, at, message):
+        token = next(self.counter)
+        heapq.heappush(self.heap, (at, token, message))
+        return token
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while self.running and (not self.heap or self.heap[0][0] > time.perf_counter()):
+                    timeout = self.heap[0][0] - time.perf_counter() if self.heap else None
+                    self.condition.wait(timeout)
+                if not self.running:
+                    break
+                at, token, message = heapq.heappop(self.heap)
+                if token in self.cancelled:
+                    self.cancelled.discard(token)
+                    continue
+            self.port.send(message)
+
+    def pending(self):
+        with self.condition:
+            return len(self.heap) - len(self.cancelled)
+
+    def flush(self):
+        """
+        Send everything still pending (e.g. the note_offs) right away
+        """
+        with self.condition:
+            due = sorted(m for m in self.heap if m[1] not in self.cancelled)
+            self.heap, self.cancelled = [], set()
+            self.sounding.clear()
+        for at, token, message in due:
+            self.port.send(message)
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.thread.join()
+        self.flush()
@@ -0,0 +1,227 @@
+import os
+import threading
+import numpy as np
+import scipy.fft
+from concurrent.futures import ThreadPoolExecutor
+from numpy.lib.stride_tricks import as_strided
+import ml_midi.config as config
+
+
+def hz_to_mel(frequencies):
+    """
+    Slaney mel scale: linear below 1 kHz, logarithmic above
+    """
+    frequencies = np.asanyarray(frequencies, dtype=np.float64)
+    f_sp = 200.0 / 3
+    min_log_hz = 1000.0
+    min_log_mel = min_log_hz / f_sp
+    logstep = np.log(6.4) / 27.0
+    mels = frequencies / f_sp
+    log_region = frequencies >= min_log_hz
+    mels = np.where(
+        log_region,
+        min_log_mel + np.log(np.maximum(frequencies, min_log_hz) / min_log_hz) / logstep,
+        mels)
+    return mels
+
+def mel_to_hz(mels):
+    mels = np.asanyarray(mels, dtype=np.float64)
+    f_sp = 200.0 / 3
+    min_log_hz = 1000.0
+    min_log_mel = min_log_hz / f_sp
+    logstep = np.log(6.4) / 27.0
+    return np.where(
+        mels >= min_log_mel,
+        min_log_hz * np.exp(logstep * (mels - min_log_mel)),
+        f_sp * mels)
+
+def mel_filterbank(sample_rate, n_fft, n_mels, fmin, fmax):
+    """
+    Triangular, area normalized mel filters of shape (n_mels, n_fft // 2 + 1),
+    same as librosa.filters.mel with the default (Slaney) settings
+    """
+    fftfreqs = np.fft.rfftfreq(n_fft, 1.0 / sample_rate)
+    mel_f = mel_to_hz(np.linspace(hz_to_mel(fmin), hz_to_mel(fmax), n_mels + 2))
+    fdiff = np.diff(mel_f)
+    ramps = np.subtract.outer(mel_f, fftfreqs)
+
+    lower = -ramps[:-2] / fdiff[:-1, None]
+    upper = ramps[2:] / fdiff[1:, None]
+    weights = np.maximum(0, np.minimum(lower, upper))
+    weights *= (2.0 / (mel_f[2:] - mel_f[:-2]))[:, None]
+
+    return weights.astype(np.float32)
+
+
+class SpectrogramEngine(object):
+    """
+    Mel spectrogram (in dB) with everything that only depends on the
+    parameters precomputed: the mel filterbank, the Hann window and a
+    strided frame view into the zero-padded wave buffer. The plan is rebuilt
+    only when SAMPLE_RATE, RECORDING_LENGTH, FFT_LENGTH, TIMESTEPS,
+    FREQUENCY_BANDS, SPECTROGRAM_LOW/HIGH or the wave length change.
+
+    Matches librosa.feature.melspectrogram + power_to_db (centered frames,
+    power 2, 80 dB dynamic range) as previously used by process.melspectrogram.
+    The scratch buffers are shared, use one engine per thread.
+    """
+    top_db = 80.
+    amin = 1e-10
+    scratch_bytes = 2**20 # frame buffer per batch chunk, about the L2 cache
+
+    def __init__(self):
+        self.key = None
+
+    def parameters(self):
+        return (config.SAMPLE_RATE, config.RECORDING_LENGTH, config.FFT_LENGTH,
+                config.TIMESTEPS, config.FREQUENCY_BANDS,
+                config.SPECTROGRAM_LOW, config.SPECTROGRAM_HIGH)
+
+    def prepare(self, length):
+        """
+        Build the plan for waves of `length` samples if the config changed
+        """
+        key = self.parameters() + (length,)
+        if key == self.key:
+            return
+        sample_rate, recording_length, n_fft, timesteps, bands, low, high = key[:-1]
+
+        self.n_fft = n_fft
+        self.hop_length = recording_length // (timesteps + 1)
+        self.n_frames = 1 + length // self.hop_length
+        self.shape = (bands, self.n_frames)
+        self.filterbank = mel_filterbank(sample_rate, n_fft, bands, low, high)
+        # only the bins under some filter take part in the power and matmul
+        used = np.flatnonzero(self.filterbank.any(axis=0))
+        self.bins = slice(used[0], used[-1] + 1) if len(used) else slice(0, 1)
+        self.weights = np.ascontiguousarray(self.filterbank[:, self.bins])
+        n = np.arange(n_fft)
+        self.window = (0.5 - 0.5 * np.cos(2 * np.pi * n / n_fft)).astype(np.float32)
+
+        self.padded = np.zeros(length + 2 * (n_fft // 2), dtype=np.float32)
+        stride = self.padded.strides[0]
+        self.frame_view = as_strided(
+            self.padded,
+            shape=(self.n_frames, n_fft),
+            strides=(self.hop_length * stride, stride),
+            writeable=False)
+        self.frames = np.zeros((self.n_frames, n_fft), dtype=np.float32)
+        self.power = np.zeros((self.weights.shape[1], self.n_frames), dtype=np.float32)
+        self.local = threading.local()
+        self.key = key
+
+    def compute(self, wave, normalize=False, out=None):
+        """
+        Mel spectrogram in dB of shape (FREQUENCY_BANDS, frames).
+        Written into `out` if given, otherwise into a new array.
+        """
+        self.prepare(len(wave))
+        offset = self.n_fft // 2
+        self.padded[offset:offset+len(wave)] = wave
+        np.multiply(self.frame_view, self.window, out=self.frames)
+
+        spectrum = scipy.fft.rfft(self.frames, axis=1, overwrite_x=True).T
+        np.abs(spectrum[self.bins], out=self.power)
+        self.power *= self.power
+
+        if out is None:
+            out = np.empty(self.shape, dtype=np.float32)
+        np.matmul(self.weights, self.power, out=out)
+        self.to_decibels(out)
+        if normalize:
+            minimum = out.min()
+            out -= minimum
+            out /= float(out.max())
+
+        return out
+
+    def compute_batch(self, waves, normalize=False, chunk_size=None, out=None, workers=None):
+        """
+        Mel spectrograms of an (N, length) stack of waves, returns an
+        (N, FREQUENCY_BANDS, frames) float32 array identical to calling
+        compute() on every row.
+
+        The waves are processed in chunks of `chunk_size` waves, by default
+        as many as fit their frames and spectra in `scratch_bytes`, so the
+        window, FFT, power and matmul passes stay in cache. When a single
+        wave already fills it (the default 2048-point FFT does), this is a
+        plain compute() loop. The chunks run on `workers` threads (default
+        min(LOAD_WORKERS, cpu count); FFT and matmul release the GIL) only
+        if there are at least two chunks per thread.
+        """
+        waves = np.asarray(waves)
+        n_waves, length = waves.shape
+        self.prepare(length)
+        if chunk_size is None:
+            per_wave = self.n_frames * (self.n_fft * 4 + (self.n_fft // 2 + 1) * 8)
+            chunk_size = max(1, self.scratch_bytes // per_wave)
+        if workers is None:
+            workers = min(config.LOAD_WORKERS, os.cpu_count() or 1)
+        if out is None:
+            out = np.empty((n_waves,) + self.shape, dtype=np.float32)
+
+        starts = range(0, n_waves, chunk_size)
+        if workers > 1 and len(starts) >= 2 * workers:
+            chunk = lambda start: self._chunk(waves[start:start+chunk_size], out[start:start+chunk_size], normalize)
+            with ThreadPoolExecutor(workers) as pool:
+                list(pool.map(chunk, starts))
+        elif chunk_size == 1:
+            for wave, image in zip(waves, out):
+                self.compute(wave, normalize, out=image)
+        else:
+            for start in starts:
+                self._chunk(waves[start:start+chunk_size], out[start:start+chunk_size], normalize)
+
+        return out
+
+    def _scratch(self, n):
+        """
+        Per thread buffers for chunks of up to n waves
+        """
+        scratch = getattr(self.local, 'scratch', None)
+        if scratch is None or len(scratch[0]) < n:
+            scratch = (
+                np.zeros((n, len(self.padded)), dtype=np.float32),
+                np.empty((n, self.n_frames, self.n_fft), dtype=np.float32),
+                np.empty((n, self.n_frames, self.weights.shape[1]), dtype=np.float32),
+                np.empty((n, self.n_frames, self.shape[0]), dtype=np.float32))
+            self.local.scratch = scratch
+        return scratch
+
+    def _chunk(self, waves, out, normalize):
+        n, length = waves.shape
+        padded, frames, power, mel = (buffer[:n] for buffer in self._scratch(n))
+        offset = self.n_fft // 2
+        padded[:, offset:offset+length] = waves
+        stride = padded.strides
+        view = as_strided(
+            padded,
+            shape=(n, self.n_frames, self.n_fft),
+            strides=(stride[0], self.hop_length * stride[1], stride[1]),
+            writeable=False)
+        np.multiply(view, self.window, out=frames)
+
+        spectrum = scipy.fft.rfft(frames, axis=2, overwrite_x=True)
+        np.abs(spectrum[..., self.bins], out=power)
+        power *= power
+        np.matmul(power, self.weights.T, out=mel)
+
+        out[:] = mel.transpose(0, 2, 1)
+        self.to_decibels(out, axis=(1, 2))
+        if normalize:
+            out -= out.min(axis=(1, 2), keepdims=True)
+            out /= out.max(axis=(1, 2), keepdims=True)
+
+    def to_decibels(self, power, axis=None):
+        """
+        In-place power_to_db with ref=1.0 and a top_db floor,
+        the floor is taken per image over `axis` for batches
+        """
+        np.maximum(power, self.amin, out=power)
+        np.log10(power, out=power)
+        power *= 10.
+        np.maximum(power, power.max(axis=axis, keepdims=axis is not None) - self.top_db, out=power)
+        return power
+
+
+engine = SpectrogramEngine()
@@ -0,0 +1,238 @@
+import numpy as np
+import os, glob, json, time, wave
+import ml_midi.config as config
+
+
+class PackedStore(object):
+    """
+    Packed, append-only dataset of fixed-length recordings:
+
+        waves.bin   int16 rows of `length` samples (shorter waves zero padded)
+        index.bin   one index_dtype record per row (label code, id, timestamp, length)
+        meta.json   row length, sample rate and the label names
+
+    Both binary files are memory-mapped for zero-copy random access. A row
+    becomes visible once its index record is written, so readers never see a
+    half written wave. The row count is read from the index once (and after
+    refresh(), for stores another process appends to) and kept by append().
+    """
+    index_dtype = np.dtype([
+        ('label', '<i2'),
+        ('id', '<i4'),
+        ('timestamp', '<f8'),
+        ('length', '<i4')])
+
+    def __init__(self, directory, length=None, sample_rate=None):
+        self.directory = directory
+        self.wave_path = os.path.join(directory, 'waves.bin')
+        self.index_path = os.path.join(directory, 'index.bin')
+        self.meta_path = os.path.join(directory, 'meta.json')
+
+        if os.path.isfile(self.meta_path):
+            with open(self.meta_path) as f:
+                meta = json.load(f)
+        else:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            meta = dict(
+                length=length or config.RECORDING_LENGTH,
+                sample_rate=sample_rate or config.SAMPLE_RATE,
+                labels=[])
+            self._write_meta(meta)
+            open(self.wave_path, 'wb').close()
+            open(self.index_path, 'wb').close()
+
+        self.length = meta['length']
+        self.sample_rate = meta['sample_rate']
+        self.labels = meta['labels']
+        self.stride = self.length * 2
+        self.wave_file = None
+        self.index_file = None
+        self.mapped = -1
+        self.refresh()
+
+    def __len__(self):
+        return self.count
+
+    def refresh(self):
+        """
+        Re-read the row count from the index file
+        """
+        self.count = os.path.getsize(self.index_path) // self.index_dtype.itemsize
+        self._map()
+        return self.count
+
+    @staticmethod
+    def remove(directory):
+        """
+        Delete the store files in directory, if any
+        """
+        for name in ('waves.bin', 'index.bin', 'meta.json'):
+            path = os.path.join(directory, name)
+            if os.path.isfile(path):
+                os.remove(path)
+
+    def _write_meta(self, meta):
+        temp = self.meta_path + '.tmp'
+        with open(temp, 'w') as f:
+            json.dump(meta, f)
+        os.replace(temp, self.meta_path)
+
+    def _map(self):
+        """
+        (Re)map the files if rows were appended since the last mapping
+        """
+        count = self.count
+        if count == self.mapped:
+            return
+        if count:
+            self._waves = np.memmap(self.wave_path, dtype=np.int16, mode='r',
+                                    shape=(count, self.length))
+            self._index = np.memmap(self.index_path, dtype=self.index_dtype,
+                                    mode='r', shape=(count,))
+        else:
+            self._waves = np.zeros((0, self.length), dtype=np.int16)
+            self._index = np.zeros(0, dtype=self.index_dtype)
+        self.mapped = count
+
+    @property
+    def waves(self):
+        """
+        (n, length) int16 memmap of all the rows
+        """
+        self._map()
+        return self._waves
+
+    @property
+    def index(self):
+        self._map()
+        return self._index
+
+    def label_code(self, label):
+        if label not in self.labels:
+            self.labels.append(label)
+            self._write_meta(dict(
+                length=self.length,
+                sample_rate=self.sample_rate,
+                labels=self.labels))
+        return self.labels.index(label)
+
+    def append(self, wave, label, sample_id=None, timestamp=None):
+        """
+        Append one recording, returns its row number
+        """
+        wave = np.asarray(wave, dtype=np.int16)
+        if len(wave) > self.length:
+            raise ValueError('Wave of {} samples does not fit rows of {}'.format(len(wave), self.length))
+        row = np.zeros(self.length, dtype=np.int16)
+        row[:len(wave)] = wave
+        code = self.label_code(label)
+        if sample_id is None:
+            sample_id = int(np.sum(self.index['label'] == code)) + 1
+        record = np.array(
+            [(code, sample_id, timestamp or time.time(), len(wave))],
+            dtype=self.index_dtype)
+
+        if self.wave_file is None:
+            self._open()
+        n = self.count
+        self.wave_file.seek(n * self.stride)
+        self.wave_file.write(row.tobytes())
+        self.wave_file.flush()
+        self.index_file.seek(n * self.index_dtype.itemsize)
+        self.index_file.write(record.tobytes())
+        self.index_file.flush()
+        self.count = n + 1
+
+        return n
+
+    def _open(self):
+        """
+        Open the files for writing, cutting off a row that was only
+        partly written (no index record) when the last writer stopped
+        """
+        self.refresh()
+        self.wave_file = open(self.wave_path, 'r+b')
+        self.index_file = open(self.index_path, 'r+b')
+        self.wave_file.truncate(self.count * self.stride)
+        self.index_file.truncate(self.count * self.index_dtype.itemsize)
+
+    def wave(self, row):
+        """
+        Zero-copy view of a recording without its padding
+        """
+        return self.waves[row, :self.index['length'][row]]
+
+    def label(self, row):
+        return self.labels[self.index['label'][row]]
+
+    def rows(self, label):
+        """
+        Row numbers of all recordings of a label
+        """
+        if label not in self.labels:
+            return np.zeros(0, dtype=np.int64)
+        return np.flatnonzero(self.index['label'] == self.labels.index(label))
+
+    def sync(self):
+        """
+        fsync the appended rows
+        """
+        if self.wave_file is not None:
+            os.fsync(self.wave_file.fileno())
+            os.fsync(self.index_file.fileno())
+
+    def close(self):
+        if self.wave_file is not None:
+            self.wave_file.close()
+            self.index_file.close()
+            self.wave_file = self.index_file = None
+
+    @classmethod
+    def from_wav_folder(cls, audio_dir, directory, length=None):
+        """
+        Import an audio/<name>/<label>/<id>.wav dataset, replacing
+        what was packed in directory before. The rows are as long as the
+        longest file unless a length is given.
+        """
+        files = []
+        for subdir in sorted(glob.glob(os.path.join(audio_dir, '*', ''))):
+            label = os.path.basename(os.path.normpath(subdir))
+            files += [(label, path) for path in sorted(glob.glob(os.path.join(subdir, '*.wav')))]
+        if length is None and files:
+            length = max(cls._frames(path) for _, path in files)
+
+        cls.remove(directory)
+        store = cls(directory, length=length)
+        for label, path in files:
+            name = os.path.splitext(os.path.basename(path))[0]
+            sample_id = int(name) if name.isdigit() else None
+            wavefile = wave.open(path, 'rb')
+            data = np.frombuffer(wavefile.readframes(wavefile.getnframes()), dtype=np.int16)
+            wavefile.close()
+            store.append(data, label, sample_id=sample_id,
+                         timestamp=os.path.getmtime(path))
+        store.close()
+        return store
+
+    @staticmethod
+    def _frames(path):
+        wavefile = wave.open(path, 'rb')
+        n = wavefile.getnframes()
+        wavefile.close()
+        return n
+
+    def export_wav_folder(self, audio_dir):
+        """
+        Write every recording back to audio_dir/<label>/<id>.wav
+        """
+        for row in range(len(self)):
+            folder = os.path.join(audio_dir, self.label(row))
+            if not os.path.isdir(folder):
+                os.makedirs(folder)
+            wavefile = wave.open(os.path.join(folder, '{}.wav'.format(self.index['id'][row])), 'wb')
+            wavefile.setnchannels(1)
+            wavefile.setsampwidth(2)
+            wavefile.setframerate(self.sample_rate)
+            wavefile.writeframes(self.wave(row).tobytes())
+            wavefile.close()
@@ -0,0 +1,231 @@
+import numpy as np
+import scipy.fft
+from numpy.lib.stride_tricks import as_strided
+import ml_midi.config as config
+from .spectral import SpectrogramEngine
+
+
+class StreamingSpectrogram(object):
+    """
+    Incremental mel spectrogram of the capture ring buffer. Every update()
+    only transforms the STFT frames that became complete since the last
+    call (frames overlap by n_fft - hop samples, which are read again from
+    the buffer) and writes them into a circular image of the last `history`
+    frames. The image is mirrored like the RingBuffer, so latest() is a
+    zero-copy (bands, n) view in time order.
+
+    Window, hop and filterbank come from a SpectrogramEngine, i.e. the same
+    as process.melspectrogram, and are rebuilt when the spectrogram config
+    changes, so FREQUENCY_BANDS / SPECTROGRAM_LOW / HIGH can be tuned live.
+    Values are in dB (ref 1.0) without the per-image top_db floor.
+    compute() frames a whole recording the same way, for training windows.
+    """
+    def __init__(self, buffer, history=None, max_frames=256):
+        self.buffer = buffer
+        self.history = history or config.STREAM_HISTORY
+        self.max_frames = max_frames
+        self.engine = SpectrogramEngine()
+        self.key = None
+        self.configure()
+
+    def configure(self):
+        """
+        Rebuild the plan if the spectrogram parameters changed
+        """
+        self.engine.prepare(config.RECORDING_LENGTH)
+        if self.engine.key == self.key:
+            return False
+        self.key = self.engine.key
+        self.n_fft = self.engine.n_fft
+        self.hop = self.engine.hop_length
+        self.window = self.engine.window
+        self.filterbank_t = np.ascontiguousarray(self.engine.filterbank.T)
+        self.bands = self.filterbank_t.shape[1]
+        self.frames = np.empty((self.max_frames, self.n_fft), dtype=np.float32)
+        self.power = np.empty((self.max_frames, self.n_fft // 2 + 1), dtype=np.float32)
+        self.rows = np.empty((2 * self.history, self.bands), dtype=np.float32)
+        self.reset()
+        return True
+
+    def reset(self):
+        """
+        Forget the image, the next update() starts on the newest frame
+        """
+        self.position = None
+        self.start = 0
+        self.count = 0
+        self.rows[:] = 10. * np.log10(self.engine.amin)
+
+    def frame_position(self, index):
+        """
+        Absolute sample position of the first sample of frame `index`
+        """
+        return self.start + index * self.hop
+
+    def update(self):
+        """
+        Transform the newly complete frames, returns how many were added
+        """
+        self.configure()
+        written, oldest = self.buffer.written, self.buffer.oldest()
+        if self.position is None or self.position < oldest:
+            # (re)start on the newest complete frame, the image is not continuous
+            self.position = max(oldest, written - self.n_fft)
+            self.start = self.position - self.count * self.hop
+
+        added = 0
+        while True:
+            n = (written - self.position - self.n_fft) // self.hop + 1
+            if n <= 0:
+                return added
+            n = min(n, self.max_frames)
+            block = self.buffer.view(self.position, (n - 1) * self.hop + self.n_fft)
+            if block is None:
+                self.position = None
+                return added
+            self._write(self._transform(block, n))
+            self.position += n * self.hop
+            added += n
+
+    def _transform(self, block, n):
+        """
+        (n, bands) dB mel spectra of the n frames of a contiguous block,
+        n <= max_frames (the result is a scratch array)
+        """
+        stride = block.strides[0]
+        frames = as_strided(block, shape=(n, self.n_fft),
+                            strides=(self.hop * stride, stride), writeable=False)
+        np.multiply(frames, self.window, out=self.frames[:n])
+        spectrum = scipy.fft.rfft(self.frames[:n], axis=1, overwrite_x=True)
+        power = self.power[:n]
+        np.abs(spectrum, out=power)
+        power *= power
+        mel = power @ self.filterbank_t
+        np.maximum(mel, self.engine.amin, out=mel)
+        np.log10(mel, out=mel)
+        mel *= 10.
+        return mel
+
+    def compute(self, samples):
+        """
+        (bands, n) dB image of every complete frame of a recording, framed
+        and transformed as update() does it for the capture buffer (frames
+        start at sample 0 and every hop, no centering or padding)
+        """
+        self.configure()
+        samples = np.ascontiguousarray(samples)
+        n_frames = max(0, (len(samples) - self.n_fft) // self.hop + 1)
+        image = np.empty((n_frames, self.bands), dtype=np.float32)
+        for i in range(0, n_frames, self.max_frames):
+            n = min(self.max_frames, n_frames - i)
+            block = samples[i * self.hop:(i + n - 1) * self.hop + self.n_fft]
+            image[i:i + n] = self._transform(block, n)
+        return image.T
+
+    def _write(self, mel):
+        n = len(mel)
+        if n > self.history:
+            self.count += n - self.history
+            mel = mel[-self.history:]
+            n = self.history
+        index = (self.count + np.arange(n)) % self.history
+        self.rows[index] = mel
+        self.rows[index + self.history] = mel
+        self.count += n
+
+    def latest(self, n_frames=None):
+        """
+        (bands, n_frames) zero-copy view of the newest frames, oldest first
+        """
+        n_frames = min(n_frames or self.history, self.history, self.count)
+        return self.view(self.count, n_frames)
+
+    def image(self):
+        """
+        (bands, history) zero-copy view of the whole image, oldest first.
+        Its shape is fixed from the start (frames not computed yet are at
+        the dB floor), so a display can keep its setup.
+        """
+        start = self.count % self.history
+        return self.rows[start:start + self.history].T
+
+    def view(self, end, n_frames):
+        """
+        (bands, n_frames) view of the frames before frame `end`,
+        None if they are not (or no longer) in the image
+        """
+        if end > self.count or end - n_frames < max(0, self.count - self.history):
+            return None
+        start = (end - n_frames) % self.history
+        return self.rows[start:start + n_frames].T
+
+
+def window_features(windows, out=None):
+    """
+    Classifier input from (..., bands, frames) dB windows: the top_db floor
+    and NORMALIZE are applied per window, as SpectrogramEngine.compute does
+    for whole recordings
+    """
+    axis = (-2, -1)
+    if out is None:
+        out = np.array(windows, dtype=np.float32)
+    else:
+        out[...] = windows
+    np.maximum(out, out.max(axis=axis, keepdims=True) - SpectrogramEngine.top_db, out=out)
+    if config.NORMALIZE:
+        out -= out.min(axis=axis, keepdims=True)
+        out /= out.max(axis=axis, keepdims=True)
+    return out
+
+def onset_offset(hop, n_fft, pre_trigger=None):
+    """
+    Samples from the first sample of a rolling window to the onset it is
+    trained on: the centre of frame PRE_TRIGGER // hop of the window
+    """
+    pre_trigger = config.PRE_TRIGGER if pre_trigger is None else pre_trigger
+    return (pre_trigger // hop) * hop + n_fft // 2
+
+def find_onsets(wave, detector=None):
+    """
+    Absolute sample positions of the onsets in a recording
+    """
+    from .onset import create_detector
+    detector = detector or create_detector()
+    onsets = []
+    for position in range(0, len(wave), detector.hop):
+        onset = detector.process(wave[position:position + detector.hop], position)
+        if onset is not None:
+            onsets.append(onset)
+    return onsets
+
+def event_windows(wave, onsets=None, frames=None):
+    """
+    Streaming training windows of the hits in a longer recording `wave`,
+    at the sample positions `onsets` (default: found by the onset
+    detector). The windows are framed by a StreamingSpectrogram, with the
+    onset where the rolling window has it when the hit is picked, so the
+    recording needs onset_offset() samples before every onset; hits too
+    close to the start or end are left out. Returns (n, bands, frames).
+    """
+    frames = frames or config.streaming_config['frames']
+    stream = StreamingSpectrogram(None, history=frames, max_frames=frames)
+    offset = onset_offset(stream.hop, stream.n_fft)
+    span = (frames - 1) * stream.hop + stream.n_fft
+    if onsets is None:
+        onsets = find_onsets(wave)
+    windows = [stream.compute(wave[onset - offset:onset - offset + span])
+               for onset in onsets if offset <= onset <= len(wave) - span + offset]
+    if not windows:
+        return np.zeros((0, stream.bands, frames), dtype=np.float32)
+    return window_features(np.stack(windows))
+
+def background_windows(wave, frames=None, stride=None):
+    """
+    No-event training windows of a longer recording without hits, every
+    `stride` frames of its streaming spectrogram
+    """
+    frames = frames or config.streaming_config['frames']
+    stride = stride or config.streaming_config['stride']
+    spectrogram = StreamingSpectrogram(None, history=frames).compute(wave)
+    starts = range(0, spectrogram.shape[1] - frames + 1, stride)
+    return window_features(np.stack([spectrogram[:, i:i + frames] for i in starts]))
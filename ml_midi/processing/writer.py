@@ -0,0 +1,79 @@
+import os
+import queue
+import threading
+import time
+import ml_midi.config as config
+
+
+class BackgroundWriter(object):
+    """
+    Persists recordings on its own thread so the detection loop never waits
+    on the disk. Jobs run in submission order; the files they touched are
+    fsync'ed together once the queue runs dry or every `sync_interval`
+    seconds, whichever comes first.
+    """
+    def __init__(self, sync_interval=None):
+        self.sync_interval = config.SYNC_INTERVAL if sync_interval is None else sync_interval
+        self.queue = queue.Queue()
+        self.unsynced = []
+        self.last_sync = time.time()
+        self.errors = []
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, function, *args, **kwargs):
+        """
+        Run function(*args, **kwargs) on the writer thread, it returns the
+        list of paths (or objects with a sync() method) to flush
+        """
+        self.queue.put((function, args, kwargs))
+
+    def _run(self):
+        while True:
+            try:
+                job = self.queue.get(timeout=self.sync_interval)
+            except queue.Empty:
+                self.sync()
+                continue
+            if job is None:
+                self.sync()
+                self.queue.task_done()
+                break
+
+            function, args, kwargs = job
+            try:
+                self.unsynced.extend(function(*args, **kwargs) or [])
+            except Exception as e:
+                self.errors.append(e)
+                print('Writer: {}'.format(e))
+            if self.queue.empty() or time.time() - self.last_sync > self.sync_interval:
+                self.sync()
+            self.queue.task_done()
+
+    def sync(self):
+        """
+        fsync everything written since the last sync (writer thread only)
+        """
+        for target in dict.fromkeys(self.unsynced):
+            try:
+                if hasattr(target, 'sync'):
+                    target.sync()
+                else:
+                    fd = os.open(target, os.O_RDONLY)
+                    os.fsync(fd)
+                    os.close(fd)
+            except OSError as e:
+                self.errors.append(e)
+        self.unsynced = []
+        self.last_sync = time.time()
+
+    def flush(self):
+        """
+        Block until everything submitted so far is on disk
+        """
+        self.queue.join()
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
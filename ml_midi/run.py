@@ -1,8 +1,63 @@
-from ml_midi.interface import QtInterface, Window
+import argparse
 
-if __name__ == "__main__":
 
-    # interface = QtInterface()
-    interface = Window()
-    interface.main()
-    
\ No newline at end of file
+def headless(args):
+    """
+    Capture -> classify -> MIDI without importing any GUI toolkit
+    """
+    from ml_midi.processing import MidiController, ReplayBackend, Midi, create_midi_backend
+    from ml_midi.learning import load_classifier
+
+    try:
+        classifier = load_classifier(args.model)
+    except ValueError as e:
+        print('Cannot load the model:\n{}'.format(e))
+        return
+
+    backend = None
+    if args.replay:
+        backend = ReplayBackend(args.replay, realtime=not args.fast, loop=args.loop)
+    midi = Midi(backend=create_midi_backend(args.midi)) if args.midi else None
+    controller = MidiController(
+        classifier=classifier,
+        midi=midi,
+        backend=backend,
+        streaming=args.streaming or None)
+
+    if args.verbose:
+        controller.subscribe(lambda event: print('Hit: label {}, latency {:.2f} ms'.format(
+            event['label'], 1000 * event['latency'])))
+    print('Running headless, Ctrl-C to stop.')
+    try:
+        controller.run(duration=args.duration, report_interval=args.report)
+    except ValueError as e:
+        print('Cannot run: {}'.format(e))
+    finally:
+        controller.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Audio classification and MIDI control.')
+    parser.add_argument('--headless', action='store_true', help='run the controller without the GUI')
+    parser.add_argument('--replay', nargs='+', metavar='WAV', help='use wav files as the input (implies --headless)')
+    parser.add_argument('--fast', action='store_true', help='replay as fast as possible instead of in real time')
+    parser.add_argument('--loop', action='store_true', help='loop the replayed files')
+    parser.add_argument('--model', default=None, help='model bundle or exported .npz (default: config.MODEL_BUNDLE)')
+    parser.add_argument('--midi', default=None, choices=['mido', 'loopback'], help='MIDI output backend')
+    parser.add_argument('--streaming', action='store_true', help='classify a rolling window instead of detected onsets')
+    parser.add_argument('--duration', type=float, default=None, help='stop after this many seconds')
+    parser.add_argument('--report', type=float, default=5., help='latency report interval in seconds, 0 for none')
+    parser.add_argument('-v', '--verbose', action='store_true', help='print every hit')
+    args = parser.parse_args()
+
+    if args.headless or args.replay:
+        headless(args)
+    else:
+        from ml_midi.interface import QtInterface, Window
+        # interface = QtInterface()
+        interface = Window()
+        interface.main()
+
+
+if __name__ == "__main__":
+    main()
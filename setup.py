@@ -7,6 +7,7 @@ packages = [
     'pyaudio',
     'python-rtmidi',
     'mido',
+    'pyyaml',
     'scipy', 
     'Pillow', 
     'opencv-python', 